@@ -21,8 +21,10 @@
 #  along with this program; if not,  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import os
+import sys
 #import ElParsito3 as ep
-from wingman import Alignment,Data
+from wingman import Alignment,Data,Cache,Metrics,Profiler
 from wingman.ErrorHandling import *
 
 
@@ -33,8 +35,8 @@ parser = argparse.ArgumentParser(description="Concatenates DNA data matrices")
 # Main execution
 main_exec = parser.add_argument_group("Main execution")
 main_exec.add_argument("-in",dest="infile",nargs="+",help="Provide the input file name. If multiple files are provided, plase separated the names with spaces")
-main_exec.add_argument("-if",dest="input_format",default="guess",choices=["fasta","nexus","phylip","guess"],help="Format of the input file(s). The default is 'guess' in which the program tries to guess the input format and genetic code automatically")
-main_exec.add_argument("-of",dest="output_format",nargs="+",default="nexus",choices=["nexus","phylip","fasta","mcmctree"],help="Format of the ouput file(s). You may select multiple output formats simultaneously (default is '%(default)s')")
+main_exec.add_argument("-if",dest="input_format",default="guess",choices=["fasta","nexus","phylip","binary","guess"],help="Format of the input file(s). The default is 'guess' in which the program tries to guess the input format and genetic code automatically. Files in binary format are always recognized automatically")
+main_exec.add_argument("-of",dest="output_format",nargs="+",default=["nexus"],choices=["nexus","phylip","fasta","mcmctree","binary"],help="Format of the ouput file(s). The 'binary' format is a compact file with the extension '.elc' that keeps the partitions and coded gaps of the alignment, and that is loaded much faster than text formats, especially with the '-storage mmap' option. You may select multiple output formats simultaneously, except for the 'phylip' and 'mcmctree' formats, which are both written into a '.phy' file (default is '%(default)s')")
 main_exec.add_argument("-o",dest="outfile",help="Name of the output file")
 
 # Alternative modes
@@ -44,36 +46,51 @@ alternative.add_argument("-r",dest="reverse",help="Reverse a concatenated file i
 alternative.add_argument("-z","--zorro-suffix",dest="zorro",type=str, help="Use this option if you wish to concatenate auxiliary Zorro files associated with each alignment. Provide the sufix for the concatenated zorro file")
 alternative.add_argument("-p","--partition-file", dest="partition_file", type=str, help="Using this option and providing the partition file will convert it between a RAxML or Nexus format")
 alternative.add_argument("-collapse", dest="collapse",action="store_const",const=True, default=False, help="Use this flag if you would like to collapse the input alignment(s) into unique haplotypes")
+alternative.add_argument("-collapse-stream", dest="collapse_stream", action="store_const", const=True, default=False, help="Same as -collapse, but the correspondance between haplotypes and taxa is written while the alignment is collapsed, with one line per taxon. Use this option to reduce memory usage when collapsing very large data sets")
 alternative.add_argument("-gcoder",dest="gcoder", action="store_const", const=True, default=False, help="Use this flag to code the gaps of the alignment into a binary state matrix that is appended to the end of the alignment")
+alternative.add_argument("-stream", dest="stream", action="store_const", const=True, default=False, help="Use this flag to concatenate the input files directly into the output file(s), parsing one file at a time, instead of building the concatenated alignment in memory. Only supported for sequential nexus, phylip and fasta output formats, and it cannot be combined with the -collapse, -gcoder and -filter options")
+alternative.add_argument("-append", dest="append", nargs="+", metavar=("EXISTING", "PARTITION_FILE"), help="Appends the input files, as new loci, to an existing concatenated alignment, whose loci are not parsed again. Along with this option provide the concatenated alignment file and, optionally, its partition file (by default, the partition file with the same prefix as the alignment, e.g. 'concatenated_file_part.File', is used, and binary files keep their own partitions). Taxa absent from the existing alignment or from the new loci are filled with missing data. The output file name of the '-o' option may be the prefix of the existing alignment, in which case it is updated")
+alternative.add_argument("-stats", dest="stats", nargs="?", const=True, metavar="PARTITION_FILE", help="Computes the statistics of the input alignment(s), instead of converting or concatenating them, and writes them into two tab-separated files: one with the metrics of each locus ('_loci.tsv' suffix) and one with the metrics of each taxon ('_taxa.tsv' suffix). The metrics are the proportions of missing data and gaps, the number of variable and parsimony informative sites, the GC content and the distribution of sequence lengths. With a single concatenated input file, optionally provide its partition file to compute the metrics of each locus. The '-threads' option computes the metrics of multiple files in parallel")
+alternative.add_argument("-validate-only", dest="validate_only", action="store_const", const=True, default=False, help="Checks the input files for empty sequences, sequences of unequal length and duplicated taxa, without converting or concatenating them. The problems of all files are reported together and, if the '-o' option is provided, written into a tab-separated file with the '_validation.tsv' suffix. The program exits with an error status if any file has errors. The '-threads' option checks multiple files in parallel")
 alternative.add_argument("-filter", dest="filter", nargs=2, help="Use this option if you wish to filter the alignment's missing data. Along with this option provide the threshold percentages for gap and missing data, respectively (e.g. -filter 50 75 - filters alignments columns with more than 50%% of gap+missing data and columns with more than 75%% of true missing data)")
 
 # Formatting options
 formatting = parser.add_argument_group("Formatting options")
 formatting.add_argument("-model",dest="model_phy",default="LG",choices=["DAYHOFF","DCMUT","JTT","MTREV","WAG","RTREV","CPREV","VT","BLOSUM62","MTMAM","LG"],help="This option only applies for the concatenation of protein data into phylip format. Specify the model for all partitions defined in the partition file (default is '%(default)s')")
-formatting.add_argument("-interleave",dest="interleave",action="store_const",const="interleave",help="Specificy this option to write output files in interleave format (currently only supported for nexus files")
+formatting.add_argument("-interleave",dest="interleave",nargs="?",type=int,const=90,help="Specificy this option to write output files in interleave format (only supported for nexus and phylip files). Optionally, provide the number of sites in each block (default is 90)")
 #formatting.add_argument("-g",dest="gap",default="-",help="Symbol for gap (default is '%(default)s')")
 #formatting.add_argument("-m",dest="missing",default="n",help="Symbol for missing data (default is '%(default)s')")
 
 # Data manipulation
 manipulation = parser.add_argument_group("Data manipultation")
 manipulation.add_argument("-rm",dest="remove",nargs="*",help="Removes the specified taxa from the final alignment. Unwanted taxa my be provided in a csv file containing 1 column with a species name in each line or they may be specified in the command line and separated by whitespace")
+manipulation.add_argument("-keep",dest="keep",nargs="*",help="Removes all taxa except the specified ones from the final alignment, in order to extract a subset of taxa. The taxa to keep are provided as in the -rm option. When both options are used, the taxa are first extracted and then removed")
 manipulation.add_argument("-outgroup", dest="outgroup_taxa", nargs="*", help="Provide taxon names/number for the outgroup (This option is only supported for NEXUS output format files)")
 
 miscellaneous = parser.add_argument_group("Miscellaneous")
 miscellaneous.add_argument("-quiet", dest="quiet", action="store_const", const=True,default=False, help="Removes all terminal output")
+miscellaneous.add_argument("-storage", dest="storage", default="dict", choices=["dict","matrix","packed","mmap","lazy"], help="Storage engine for the alignments. The 'matrix' storage keeps each alignment in a single character matrix, which uses less memory and speeds up column operations on large data sets (requires numpy). The 'packed' storage keeps nucleotide sequences with two characters per byte, which halves the memory used by large DNA alignments. The 'mmap' storage reads sequential phylip and binary files directly from disk, without loading them into memory. The 'lazy' storage only indexes the taxa of fasta, sequential phylip and sequential nexus files, and reads each sequence from disk when it is used, which allows many loci to be opened with little memory (default is '%(default)s')")
+miscellaneous.add_argument("-cache", dest="cache", help="Directory of a cache of parsed alignment files. Input files found in the cache are loaded without being parsed, which speeds up repeated runs over the same files. A file that is modified is parsed again")
+miscellaneous.add_argument("-cache-size", dest="cache_size", type=int, default=2048, help="Maximum size of the cache directory in megabytes. When the cache grows larger, the least recently used files are removed (default is '%(default)s')")
+miscellaneous.add_argument("-profile", dest="profile", nargs="?", const=True, metavar="JSON_FILE", help="Reports the wall time, CPU time, bytes read and written and peak memory (RSS) of each stage of the run (parsing, concatenation, taxa removal, collapsing, gap coding, filtering and writing). Optionally, provide a file name to also write the report in JSON format. The CPU time includes the worker processes of the '-threads' option, but the bytes and memory are those of the main process")
+miscellaneous.add_argument("-cprofile", dest="cprofile", metavar="STATS_FILE", help="Runs the program under the cProfile profiler and writes its statistics into the provided file, which can be read with the pstats module (e.g. 'python -m pstats STATS_FILE')")
+miscellaneous.add_argument("-threads", dest="threads", type=int, default=1, help="Number of processes used to parse multiple input files concurrently. When converting multiple files with the '-c' option, each process converts one file at a time from start to end, including the filtering and taxa removal steps (default is '%(default)s')")
 
 arg = parser.parse_args()
 
 ##### MAIN FUNCTIONS ######
 
-def main_parser(alignment_list):
-	""" Function with the main operations of ElConcatenero """
+def main_parser(alignment_list, cache=None, profiler=None):
+	""" Function with the main operations of ElConcatenero. The optional profiler is a StageProfiler object that records the resources of each stage """
+
+	if profiler == None:
+		profiler = Profiler.StageProfiler(enabled=False)
 	
 	# Defining main variables
 	#gap = arg.gap
 	#missing_sym = arg.missing
 	conversion = arg.conversion
-	input_format = arg.input_format
+	input_format = None if arg.input_format == "guess" else arg.input_format
 	output_format = arg.output_format
 	outfile = arg.outfile
 	interleave = arg.interleave
@@ -83,8 +100,10 @@ def main_parser(alignment_list):
 	# Setting leave/interleave format
 	if interleave == None:
 		sequence_format = "leave"
+		interleave_width = 90
 	else:
 		sequence_format = "interleave"
+		interleave_width = interleave
 
 	# Defining output file name
 	if arg.conversion == None and arg.outfile != None:
@@ -105,12 +124,57 @@ def main_parser(alignment_list):
 			partition.write_to_file("nexus", outfile)
 		return 0
 
+	# Validation of the input files, in which the problems of all files are reported at once
+	if arg.validate_only == True:
+
+		profiler.stage("Validating")
+		problems = Alignment.validate_alignments(alignment_list, alignment_format=input_format, threads=arg.threads, verbose=arg.quiet is False)
+		error_files = Alignment.write_validation(problems, len(alignment_list), output_file=outfile+"_validation.tsv" if outfile != None else None, verbose=arg.quiet is False)
+
+		# The status is returned to main, which exits with an error status after the profiler report
+		return 1 if error_files > 0 else 0
+
+	# Statistics of the alignments, which are computed without writing any alignment file
+	if arg.stats != None:
+
+		profiler.stage("Computing statistics")
+		metrics = Metrics.AlignmentMetrics()
+
+		if len(alignment_list) == 1:
+			alignment = Alignment.Alignment(alignment_list[0], input_format=input_format, storage=arg.storage, cache=cache, verbose=arg.quiet is False)
+			if arg.stats is not True:
+				alignment._set_loci_ranges(Data.Partitions(arg.stats).loci_ranges())
+			metrics.add_alignment(alignment)
+		else:
+			metrics.add_files(alignment_list, storage=arg.storage, threads=arg.threads, verbose=arg.quiet is False, cache=cache, input_format=input_format)
+
+		metrics.write_to_file(outfile)
+		return 0
+
+	# Incremental concatenation, in which the new loci are appended to an existing concatenated alignment
+	if arg.append != None:
+
+		profiler.stage("Parsing")
+		existing = Alignment.Alignment(arg.append[0], storage=arg.storage, cache=cache, verbose=arg.quiet is False)
+
+		if len(arg.append) > 1:
+			existing._set_loci_ranges(Data.Partitions(arg.append[1]).loci_ranges())
+		elif os.path.exists(arg.append[0].split(".")[0]+"_part.File"):
+			existing._set_loci_ranges(Data.Partitions(arg.append[0].split(".")[0]+"_part.File").loci_ranges())
+		elif getattr(existing, "loci_ranges", None) == None:
+			raise ArgumentError("The partition file of the existing alignment %s could not be found. Please provide it with the '-append' option" % (arg.append[0]))
+
+		new_loci = Alignment.AlignmentList(alignment_list, storage=arg.storage, threads=arg.threads, cache=cache, verbose=arg.quiet is False, input_format=input_format)
+
+		profiler.stage("Concatenating")
+		alignment = Alignment.AlignmentList([existing] + new_loci.alignment_object_list).concatenate(progress_stat=arg.quiet is False)
 
 	# From here, the input file is mandatory
-	if len(alignment_list) == 1:
+	elif len(alignment_list) == 1:
 
 		# In case only one alignment
-		alignment = Alignment.Alignment("".join(alignment_list))
+		profiler.stage("Parsing")
+		alignment = Alignment.Alignment("".join(alignment_list), input_format=input_format, storage=arg.storage, cache=cache, verbose=arg.quiet is False)
 
 		# Check if input format is the same as output format. If so, and no output file name has been provided, update the default output file name
 		if alignment.input_format in output_format and output_format == None:
@@ -118,64 +182,120 @@ def main_parser(alignment_list):
 
 		# If only to reverse a concatenated alignment into individual loci do this and exit
 		if arg.reverse != None:
+			profiler.stage("Splitting and writing loci")
 			partition = Data.Partitions(arg.reverse)
-			reverse_alignments = alignment.reverse_concatenate(partition)
-			reverse_alignments.write_to_file(output_format,form=sequence_format, outgroup_list=outgroup_taxa)
+			# Each locus is written as soon as it is created, so that only one locus is kept in memory
+			for locus in alignment.iter_partitions(partition):
+				locus.write_to_file(output_format, locus.input_alignment.split(".")[0], form=sequence_format, outgroup_list=outgroup_taxa, interleave_width=interleave_width)
 			return 0
 
 	else:
 
+		# Streaming concatenation, in which the output is written while the files are parsed one at a time
+		if arg.conversion == None and arg.stream != False:
+
+			profiler.stage("Scanning")
+			alignment = Alignment.AlignmentStream(alignment_list, verbose=arg.quiet is False, cache=cache, input_format=input_format)
+
+			if arg.keep != None:
+				profiler.stage("Extracting taxa")
+				if arg.quiet is False: print ("\rExtracting taxa", end="")
+				alignment.keep_taxa(arg.keep)
+
+			if arg.remove != None:
+				profiler.stage("Removing taxa")
+				if arg.quiet is False: print ("\rRemoving taxa", end="")
+				alignment.remove_taxa(arg.remove)
+
+			profiler.stage("Concatenating and writing")
+			if arg.quiet is False: print ("\rWritting output file(s)",end="")
+			alignment.write_to_file (output_format, outfile, form=sequence_format, outgroup_list=outgroup_taxa)
+
+			if arg.zorro != None:
+				zorro = Data.Zorro(alignment_list, arg.zorro)
+				zorro.write_to_file(outfile)
+
+			return 0
+
+		# Pipelined conversion, in which each file is parsed, filtered and written by one of the worker processes
+		if arg.conversion != None and arg.threads > 1:
+
+			profiler.stage("Converting")
+			Alignment.convert_alignments(alignment_list, output_format, form=sequence_format, interleave_width=interleave_width, outgroup_list=outgroup_taxa, filter_thresholds=arg.filter, taxa_list=arg.remove, keep_list=arg.keep, storage=arg.storage, threads=arg.threads, verbose=arg.quiet is False, cache=cache, input_format=input_format)
+			return 0
+
 		# With many alignments
-		alignments = Alignment.AlignmentList(alignment_list)
+		profiler.stage("Parsing")
+		alignments = Alignment.AlignmentList(alignment_list, storage=arg.storage, threads=arg.threads, cache=cache, verbose=arg.quiet is False, input_format=input_format)
 
 		if arg.conversion != None:
 
 			# In case multiple files are to be converted and an alignment filter is to be carried out
 			if arg.filter != None:
 
-				alignments.filter_missing_data64(arg.filter[0], arg.filter[1], verbose=True)
+				profiler.stage("Filtering")
+				alignments.filter_missing_data(arg.filter[0], arg.filter[1], verbose=arg.quiet is False)
+
+			# In case a subset of taxa is to be extracted while converting
+			if arg.keep != None:
+				profiler.stage("Extracting taxa")
+				alignments.keep_taxa(arg.keep, verbose=arg.quiet is False)
 
 			# In case taxa are to be removed while converting
 			if arg.remove != None:
+				profiler.stage("Removing taxa")
 				if arg.quiet is False:
 					alignments.remove_taxa(arg.remove, verbose=True)
 				else:
 					alignments.remove_taxa(arg.remove)
 
-			alignments.write_to_file(output_format, form=sequence_format, outgroup_list=outgroup_taxa)
+			profiler.stage("Writing")
+			alignments.write_to_file(output_format, form=sequence_format, outgroup_list=outgroup_taxa, interleave_width=interleave_width)
 			return 0
 
 		else:
 
-			alignment = alignments.concatenate()
+			profiler.stage("Concatenating")
+			alignment = alignments.concatenate(progress_stat=arg.quiet is False)
 
 			# If zorro weigth files are provided, concatenate them as well
 			if arg.zorro != None:
 				zorro = Data.Zorro(alignment_list, arg.zorro)
 
+	# Extracting a subset of taxa
+	if arg.keep != None:
+		profiler.stage("Extracting taxa")
+		if arg.quiet is False: print ("\rExtracting taxa", end="")
+		alignment.keep_taxa(arg.keep)
+
 	# Removing taxa
 	if arg.remove != None:
+		profiler.stage("Removing taxa")
 		if arg.quiet is False: print ("\rRemoving taxa", end="")
 		alignment.remove_taxa(arg.remove)
 
 	# Collapsing the alignment
-	if arg.collapse != False:
+	if arg.collapse != False or arg.collapse_stream != False:
+		profiler.stage("Collapsing")
 		if arg.quiet is False: print ("\rCollapsing alignment", end="")
-		alignment.collapse(haplotypes_file=outfile)
+		alignment.collapse(haplotypes_file=outfile, stream=arg.collapse_stream)
 
 	# Codes gaps into binary states
 	if arg.gcoder != False:
+		profiler.stage("Coding gaps")
 		if arg.quiet is False: print ("\rCoding gaps", end="")
-		if output_format != ["nexus"]:
-			raise OutputFormatError("Alignments with gaps coded can only be written in Nexus format")
+		if [alignment_format for alignment_format in output_format if alignment_format not in ["nexus", "binary"]] != []:
+			raise OutputFormatError("Alignments with gaps coded can only be written in Nexus or binary format")
 		alignment.code_gaps()
 
 	if arg.filter != None:
+		profiler.stage("Filtering")
 		alignment.filter_missing_data(arg.filter[0], arg.filter[1])
 
 	## Writing files
+	profiler.stage("Writing")
 	if arg.quiet is False: print ("\rWritting output file(s)",end="")
-	alignment.write_to_file (output_format, outfile, form=sequence_format, outgroup_list=outgroup_taxa)
+	alignment.write_to_file (output_format, outfile, form=sequence_format, outgroup_list=outgroup_taxa, interleave_width=interleave_width)
 
 	# In case zorro weigth files are provide, write the concatenated file 
 	if arg.zorro != None:
@@ -188,6 +308,21 @@ def main_check ():
 		
 	if arg.partition_file != None:
 		return 0
+
+	if arg.interleave != None and arg.interleave < 1:
+		raise ArgumentError ("The number of sites of each block of the '-interleave' option must be a positive integer")
+
+	if arg.validate_only == True:
+		return 0
+
+	if "phylip" in arg.output_format and "mcmctree" in arg.output_format:
+		raise ArgumentError ("The phylip and mcmctree output formats are both written into a '.phy' file and cannot be selected together")
+
+	if arg.stats != None and arg.outfile == None:
+		raise ArgumentError("The statistics of the alignments are written into files with the prefix provided with the '-o' option")
+
+	if arg.stats != None and arg.stats is not True and len(arg.infile) > 1:
+		raise ArgumentError("A partition file can only be provided with the '-stats' option for a single concatenated input file")
 		
 	if arg.conversion == None and arg.outfile == None and arg.reverse == None:
 		raise ArgumentError("If you wish to concatenate provide the output file name using the '-o' option. If you wish to convert a file, specify it using the '-c' option")
@@ -198,16 +333,54 @@ def main_check ():
 	if arg.zorro != None and len(arg.infile) == 1:
 		raise ArgumentError ("The '-z' option cannot be invoked when only a single input file is provided. This option is reserved for concatenation of multiple alignment files")
 
+	if arg.append != None and (arg.conversion != None or arg.reverse != None or arg.stream != False or arg.zorro != None or len(arg.append) > 2):
+		raise ArgumentError ("The '-append' option takes the existing alignment and, optionally, its partition file, and cannot be combined with the '-c', '-r', '-z' and '-stream' options")
+
+	if arg.stream != False and (arg.collapse != False or arg.collapse_stream != False or arg.gcoder != False or arg.filter != None or arg.interleave != None or "mcmctree" in arg.output_format or "binary" in arg.output_format):
+		raise ArgumentError ("The '-stream' option only supports sequential nexus, phylip and fasta output formats, and cannot be combined with the '-collapse', '-gcoder' and '-filter' options")
+
 	else:
 		return 0
 				
 def main():
 	main_check()
-	main_parser(arg.infile)
+
+	if arg.cache != None:
+		cache = Cache.AlignmentCache(arg.cache, arg.cache_size * 1048576)
+	else:
+		cache = None
+
+	profiler = Profiler.StageProfiler(enabled=arg.profile != None)
+
+	# The cProfile profiler only wraps the main operations, so that its statistics are not mixed with the initialization of the program
+	if arg.cprofile != None:
+		import cProfile
+		code_profile = cProfile.Profile()
+		status = code_profile.runcall(main_parser, arg.infile, cache, profiler)
+		code_profile.dump_stats(arg.cprofile)
+	else:
+		status = main_parser(arg.infile, cache, profiler)
+
+	if cache != None:
+		profiler.stage("Cache eviction")
+		cache.evict()
+
+	profiler.end()
+
+	if arg.profile != None:
+		profiler.report()
+		if arg.profile is not True:
+			profiler.write_to_file(arg.profile, sys.argv)
 
 	if arg.quiet is False: 
 		print ("\rProgram done!", end="")
 
+	# Only the -validate-only option returns an error status, when any input file has errors
+	if status == 1:
+		raise SystemExit(1)
+
 ##### EXECUTION ######
 
-main()
+# The guard prevents the worker processes of the -threads option from running the program again
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#
+#  Copyright 2012 Unknown <diogo@arch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Benchmark harness of the main operations of the wingman modules. Synthetic alignments are created with the generate module, and each operation is timed several times and run once more with tracemalloc to record its peak memory. The results are written in JSON, and a previous results file can be provided to compare two versions of the program. Use the -package option to benchmark another copy of the program with the same input files
+
+import argparse
+import gc
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+benchmarks_directory = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, benchmarks_directory)
+
+import generate
+
+parser = argparse.ArgumentParser(description="Times the main operations of the program on synthetic alignments")
+parser.add_argument("-o", dest="outfile", default="benchmark.json", help="Output file with the results in JSON format (default is '%(default)s')")
+parser.add_argument("-package", dest="package", default=os.path.dirname(benchmarks_directory), help="Directory of the copy of the program that is benchmarked (default is the parent directory of the benchmarks)")
+parser.add_argument("-loci", dest="loci", type=int, default=20, help="Number of loci (default is '%(default)s')")
+parser.add_argument("-taxa", dest="taxa", type=int, default=50, help="Number of taxa of each locus (default is '%(default)s')")
+parser.add_argument("-length", dest="length", type=int, default=2000, help="Number of sites of each locus (default is '%(default)s')")
+parser.add_argument("-gap-rate", dest="gap_rate", type=float, default=0.05, help="Proportion of gaps in each sequence (default is '%(default)s')")
+parser.add_argument("-missing-rate", dest="missing_rate", type=float, default=0.05, help="Proportion of missing data in each sequence (default is '%(default)s')")
+parser.add_argument("-code", dest="code", default="DNA", choices=["DNA", "Protein"], help="Sequence type (default is '%(default)s')")
+parser.add_argument("-storage", dest="storage", default=None, help="Storage engine of the alignments, as in the '-storage' option of the program (default is the storage of each version)")
+parser.add_argument("-repeat", dest="repeat", type=int, default=3, help="Number of timed runs of each operation (default is '%(default)s')")
+parser.add_argument("-only", dest="only", nargs="+", help="Only runs the operations whose name starts with one of the provided prefixes")
+parser.add_argument("-compare", dest="compare", help="Results file of a previous run, to which the current results are compared")
+parser.add_argument("-keep", dest="keep", help="Directory where the input and output files are kept, instead of a temporary directory that is removed at the end")
+
+arg = parser.parse_args()
+
+sys.path.insert(0, os.path.abspath(arg.package))
+
+from wingman.Alignment import Alignment, AlignmentList
+from wingman import Data
+
+def measure (run, setup=None, repeat=3):
+	""" Times a function repeat times and runs it once more under tracemalloc. The setup function, if provided, is called before each run and its return value is passed to run, so that each run starts from the same state. Neither the setup nor the garbage collection are timed. Returns a dictionary with the times of the runs, in seconds, and the peak of memory allocated during the traced run, in bytes """
+
+	times = []
+
+	for position in range(repeat + 1):
+
+		argument = setup() if setup is not None else None
+		gc.collect()
+
+		# The last run is traced, since tracemalloc slows down the allocations
+		if position == repeat:
+			tracemalloc.start()
+			run(argument)
+			peak = tracemalloc.get_traced_memory()[1]
+			tracemalloc.stop()
+		else:
+			start = time.perf_counter()
+			run(argument)
+			times.append(time.perf_counter() - start)
+
+	times.sort()
+
+	return {"times": times, "best": times[0], "median": times[len(times) // 2], "peak_memory": peak}
+
+def output_files (output_prefix):
+	""" Returns the files written by an operation, which are named after output_prefix with any extension """
+
+	return glob.glob(glob.escape(output_prefix) + ".*")
+
+def version (package):
+	""" Returns the git commit of the benchmarked copy of the program, or None if it is not available """
+
+	try:
+		return subprocess.check_output(["git", "-C", package, "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode("ascii").strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def benchmarks (work_directory, storage):
+	""" Generates the input files in work_directory and returns a list of (name, run, setup, output_prefix) tuples with the operations to benchmark. The output_prefix is the name, without extension, of the files written by the operation, or None if it does not write any file """
+
+	options = {"gap_rate": arg.gap_rate, "missing_rate": arg.missing_rate, "code": arg.code}
+
+	input_files = {}
+	for input_format, interleave in [("fasta", None), ("phylip", None), ("nexus", None), ("phylip", 90), ("nexus", 90)]:
+		name = input_format + ("_interleave" if interleave else "")
+		input_files[name] = generate.generate_files(os.path.join(work_directory, name), arg.loci, arg.taxa, arg.length, input_format, interleave, **options)
+
+	# The storage argument is only passed when it is set, so that versions without storage engines can be benchmarked
+	storage_options = {"storage": storage} if storage is not None else {}
+
+	output_directory = os.path.join(work_directory, "output")
+	os.makedirs(output_directory, exist_ok=True)
+
+	loci = AlignmentList(input_files["fasta"], verbose=False, **storage_options)
+
+	def concatenation ():
+		return loci.concatenate(progress_stat=False)
+
+	# The partition file of the concatenated alignment is used by reverse_concatenate
+	concatenation().write_to_file(["phylip"], os.path.join(work_directory, "concatenated"))
+	partitions = Data.Partitions(os.path.join(work_directory, "concatenated_part.File"))
+
+	operations = []
+
+	for name, file_list in input_files.items():
+		operations.append(("read_alignment[%s]" % (name), lambda argument, file_list=file_list: [Alignment(input_file, **storage_options) for input_file in file_list], None, None))
+
+	operations.append(("AlignmentList.concatenate", lambda argument: loci.concatenate(progress_stat=False), None, None))
+	operations.append(("filter_missing_data", lambda alignment: alignment.filter_missing_data(50, 75), concatenation, None))
+	operations.append(("code_gaps", lambda alignment: alignment.code_gaps(), concatenation, None))
+	operations.append(("collapse", lambda alignment: alignment.collapse(haplotypes_file=os.path.join(output_directory, "collapsed")), concatenation, os.path.join(output_directory, "collapsed")))
+	operations.append(("reverse_concatenate", lambda alignment: alignment.reverse_concatenate(partitions), concatenation, None))
+
+	for output_format, form in [("nexus", "leave"), ("phylip", "leave"), ("fasta", "leave"), ("mcmctree", "leave"), ("binary", "leave"), ("nexus", "interleave"), ("phylip", "interleave")]:
+		name = output_format + ("_interleave" if form == "interleave" else "")
+		operations.append(("write_to_file[%s]" % (name), lambda alignment, output_format=output_format, form=form, name=name: alignment.write_to_file([output_format], os.path.join(output_directory, name), form=form), concatenation, os.path.join(output_directory, name)))
+
+	return operations
+
+def compare (results, baseline_file):
+	""" Prints the best times of the current results and of a previous results file, and the ratio between them """
+
+	baseline = json.load(open(baseline_file))["results"]
+
+	print ("%-35s %12s %12s %8s" % ("operation", "baseline (s)", "current (s)", "ratio"))
+
+	for name, result in results.items():
+		if "best" not in result or "best" not in baseline.get(name, {}):
+			print ("%-35s %12s %12s %8s" % (name, "-", "-", "-"))
+			continue
+		print ("%-35s %12.4f %12.4f %8.2f" % (name, baseline[name]["best"], result["best"], result["best"] / baseline[name]["best"]))
+
+def main ():
+
+	if arg.keep != None:
+		work_directory = arg.keep
+		os.makedirs(work_directory, exist_ok=True)
+	else:
+		work_directory = tempfile.mkdtemp(prefix="benchmark_")
+
+	results = {}
+
+	try:
+		for name, run, setup, output_prefix in benchmarks(work_directory, arg.storage):
+
+			if arg.only != None and not [prefix for prefix in arg.only if name.startswith(prefix)]:
+				continue
+
+			print ("\rRunning %s" % (name).ljust(60), end="")
+
+			# Files left by a previous run in a kept directory would hide an operation that does not write its output
+			if output_prefix != None:
+				for output_file in output_files(output_prefix):
+					os.remove(output_file)
+
+			# Operations that are not supported by the benchmarked version are recorded with their error
+			try:
+				results[name] = measure(run, setup, arg.repeat)
+			except (Exception, SystemExit) as error:
+				results[name] = {"error": "%s: %s" % (type(error).__name__, error)}
+				continue
+
+			# Some versions silently skip unknown options, such as an output format they do not support, so the timing is only recorded if the output was written
+			if output_prefix != None and [output_file for output_file in output_files(output_prefix) if os.path.getsize(output_file) > 0] == []:
+				results[name] = {"error": "Unsupported: no output file was written"}
+	finally:
+		if arg.keep == None:
+			shutil.rmtree(work_directory)
+
+	print ("\r".ljust(70))
+
+	try:
+		import numpy
+		numpy_version = numpy.__version__
+	except ImportError:
+		numpy_version = None
+
+	parameters = {"loci": arg.loci, "taxa": arg.taxa, "length": arg.length, "gap_rate": arg.gap_rate, "missing_rate": arg.missing_rate, "code": arg.code, "storage": arg.storage, "repeat": arg.repeat}
+	environment = {"version": version(arg.package), "python": platform.python_version(), "numpy": numpy_version, "platform": platform.platform()}
+
+	out_file = open(arg.outfile, "w")
+	json.dump({"parameters": parameters, "environment": environment, "results": results}, out_file, indent=1)
+	out_file.close()
+
+	if arg.compare != None:
+		compare(results, arg.compare)
+	else:
+		for name, result in results.items():
+			print ("%-35s %s" % (name, "%.4f s, %.1f MB" % (result["best"], result["peak_memory"] / 1048576.0) if "best" in result else result["error"]))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#
+#  Copyright 2012 Unknown <diogo@arch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Generator of synthetic alignments for the benchmarks. Each alignment is built from a random ancestral sequence, which is mutated in every taxon, and then gaps and missing data are added in runs of consecutive sites. The files are written without the wingman modules, so that the same input files can be used to compare different versions of the program
+
+import argparse
+import random
+import os
+from collections import OrderedDict
+
+dna_alphabet = "acgt"
+protein_alphabet = "acdefghiklmnpqrstvwy"
+
+def _add_runs (sequence, rate, mean_run, symbol, rng):
+	""" Replaces runs of consecutive sites of a sequence (bytearray) with symbol, until approximately rate * len(sequence) sites are replaced. The length of each run is drawn uniformly between 1 and 2 * mean_run - 1 """
+
+	remaining = int(rate * len(sequence))
+
+	while remaining > 0:
+		run = min(remaining, rng.randint(1, 2 * mean_run - 1))
+		start = rng.randrange(0, max(1, len(sequence) - run + 1))
+		sequence[start:start + run] = symbol * run
+		remaining -= run
+
+def generate_alignment (taxa_number, locus_length, gap_rate=0.05, missing_rate=0.05, code="DNA", mutation_rate=0.05, mean_run=3, seed=None):
+	""" Returns an ordered dictionary with a synthetic alignment of taxa_number sequences of locus_length sites. The mutation_rate is the proportion of sites of each taxon that differ from the ancestral sequence, and gap_rate and missing_rate the proportions of gaps and missing data of each sequence. The code argument is either 'DNA' or 'Protein' """
+
+	rng = random.Random(seed)
+
+	alphabet = dna_alphabet if code == "DNA" else protein_alphabet
+	missing = b"n" if code == "DNA" else b"x"
+
+	ancestral = "".join(rng.choices(alphabet, k=locus_length)).encode("ascii")
+
+	alignment = OrderedDict()
+
+	for taxon in range(taxa_number):
+
+		sequence = bytearray(ancestral)
+
+		for site in rng.sample(range(locus_length), int(mutation_rate * locus_length)):
+			sequence[site] = ord(rng.choice(alphabet))
+
+		_add_runs(sequence, gap_rate, mean_run, b"-", rng)
+		_add_runs(sequence, missing_rate, mean_run, missing, rng)
+
+		alignment["taxon_%s" % (taxon)] = sequence.decode("ascii")
+
+	return alignment
+
+def write_alignment (alignment, output_file, output_format, interleave=None, code="DNA"):
+	""" Writes an alignment dictionary with sequences of the given code into output_file with the given format ('nexus', 'phylip' or 'fasta'). If interleave is the number of sites of each block, nexus and phylip files are written in interleaved format """
+
+	taxa_number = len(alignment)
+	locus_length = len(next(iter(alignment.values())))
+	name_space = max(len(taxon) for taxon in alignment) + 1
+
+	out_file = open(output_file, "w")
+
+	if output_format == "fasta":
+		for taxon, sequence in alignment.items():
+			out_file.write(">%s\n%s\n" % (taxon, sequence))
+		out_file.close()
+		return
+
+	if output_format == "nexus":
+		datatype = "dna" if code == "DNA" else "protein"
+		out_file.write("#NEXUS\n\nBegin data;\n\tdimensions ntax=%s nchar=%s ;\n\tformat datatype=%s interleave=%s gap=- missing=%s ;\n\tmatrix\n" % (taxa_number, locus_length, datatype, "yes" if interleave else "no", "n" if datatype == "dna" else "x"))
+	else:
+		out_file.write("%s %s\n" % (taxa_number, locus_length))
+
+	block = interleave if interleave else locus_length
+
+	for start in range(0, locus_length, block):
+		for taxon, sequence in alignment.items():
+			# In interleaved phylip files, the taxa names are only written in the first block
+			if output_format == "phylip" and start > 0:
+				out_file.write("%s\n" % (sequence[start:start + block]))
+			else:
+				out_file.write("%s%s\n" % (taxon.ljust(name_space), sequence[start:start + block]))
+		if interleave:
+			out_file.write("\n")
+
+	if output_format == "nexus":
+		out_file.write(";\n\tend;\n")
+
+	out_file.close()
+
+def generate_files (output_directory, loci_number, taxa_number, locus_length, output_format="fasta", interleave=None, seed=0, **options):
+	""" Writes loci_number synthetic alignments into output_directory and returns the list of file names. The remaining keyword arguments are passed to generate_alignment """
+
+	extensions = {"fasta": "fas", "phylip": "phy", "nexus": "nex"}
+
+	os.makedirs(output_directory, exist_ok=True)
+
+	file_list = []
+
+	for locus in range(loci_number):
+		alignment = generate_alignment(taxa_number, locus_length, seed=seed + locus, **options)
+		output_file = os.path.join(output_directory, "locus_%s.%s" % (locus, extensions[output_format]))
+		write_alignment(alignment, output_file, output_format, interleave, options.get("code", "DNA"))
+		file_list.append(output_file)
+
+	return file_list
+
+def main ():
+
+	parser = argparse.ArgumentParser(description="Generates synthetic alignment files for the benchmarks")
+	parser.add_argument("-o", dest="output_directory", required=True, help="Output directory")
+	parser.add_argument("-loci", dest="loci", type=int, default=1, help="Number of alignment files (default is '%(default)s')")
+	parser.add_argument("-taxa", dest="taxa", type=int, default=50, help="Number of taxa of each alignment (default is '%(default)s')")
+	parser.add_argument("-length", dest="length", type=int, default=1000, help="Number of sites of each alignment (default is '%(default)s')")
+	parser.add_argument("-gap-rate", dest="gap_rate", type=float, default=0.05, help="Proportion of gaps in each sequence (default is '%(default)s')")
+	parser.add_argument("-missing-rate", dest="missing_rate", type=float, default=0.05, help="Proportion of missing data in each sequence (default is '%(default)s')")
+	parser.add_argument("-mutation-rate", dest="mutation_rate", type=float, default=0.05, help="Proportion of sites of each sequence that differ from the ancestral sequence (default is '%(default)s')")
+	parser.add_argument("-code", dest="code", default="DNA", choices=["DNA", "Protein"], help="Sequence type (default is '%(default)s')")
+	parser.add_argument("-of", dest="output_format", default="fasta", choices=["fasta", "phylip", "nexus"], help="Format of the files (default is '%(default)s')")
+	parser.add_argument("-interleave", dest="interleave", nargs="?", type=int, const=90, help="Writes nexus and phylip files in interleaved format, optionally with the number of sites of each block (default is 90)")
+	parser.add_argument("-seed", dest="seed", type=int, default=0, help="Seed of the random number generator (default is '%(default)s')")
+	arg = parser.parse_args()
+
+	generate_files(arg.output_directory, arg.loci, arg.taxa, arg.length, arg.output_format, arg.interleave, arg.seed, gap_rate=arg.gap_rate, missing_rate=arg.missing_rate, mutation_rate=arg.mutation_rate, code=arg.code)
+
+if __name__ == "__main__":
+	main()
@@ -24,19 +24,44 @@
 from wingman.Base import *
 from wingman.MissingFilter import MissingFilter
 from wingman.ErrorHandling import *
-from collections import OrderedDict
+from wingman.Storage import CharacterMatrix, PackedMatrix, MappedPhylip, MappedBinary, IndexedAlignment
+from wingman import Binary
+from collections import OrderedDict, Counter
+from itertools import chain, accumulate, repeat
+from multiprocessing import Pool
+import hashlib
+import mmap
+import io
+import os
 import re
 
+# numpy is only required by the matrix storage
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+# Translation table used to remove all whitespace characters from the sequences in a single pass
+whitespace_table = str.maketrans("", "", " \t\r\n\v\f")
+
 ### To Do
 # - Create a SequenceSet class for sets of sequences that do not conform to an alignment, i.e. unequal length. This would eliminate the problems of applying methods desgined for alignments to sets of sequences with unequal length and would allows these sets of sequences to have methods of their own.
 # - After creating the SequenceSet class, an additional class should be used to make the triage of files to either the Alignment or SequenceSet classes
 
 class Alignment (Base,MissingFilter):
 
-	def __init__ (self, input_alignment,input_format=None,model_list=None, alignment_name=None, loci_ranges=None):
+	def __init__ (self, input_alignment,input_format=None,model_list=None, alignment_name=None, loci_ranges=None, storage=None, cache=None, validator=None, verbose=True):
 		""" The basic Alignment class requires only an alignment file and returns an Alignment object. In case the class is initialized with a dictionary object, the input_format, model_list, alignment_name and loci_ranges arguments can be used to provide complementary information for the class. However, if the class is not initialized with specific values for these arguments, they can be latter set using the _set_format and _set_model functions 
 
-			The loci_ranges argument is only relevant when an Alignment object is initialized from a concatenated data set, in which case it is relevant to incorporate this information in the object"""
+			The loci_ranges argument is only relevant when an Alignment object is initialized from a concatenated data set, in which case it is relevant to incorporate this information in the object
+
+			The storage argument sets the storage engine of the alignment attribute. The 'dict' storage uses an ordered dictionary of strings, the 'matrix' storage uses a CharacterMatrix object (requires numpy) and the 'packed' storage uses a PackedMatrix object, which keeps nucleotide sequences with two characters per byte. The 'mmap' storage only applies to sequential phylip and binary files, which are memory-mapped and read on demand with a MappedPhylip or MappedBinary object. The 'lazy' storage only indexes the taxa and the position of their sequences in fasta, sequential phylip and sequential nexus files with an IndexedAlignment object, so that the taxa, locus_length and sequence_code attributes are available without loading the sequences, which are read on access. By default, files are parsed into the 'dict' storage and dictionary objects are kept as they are
+
+			The cache argument is an optional AlignmentCache object. Alignment files found in the cache are loaded from it instead of being parsed, and parsed files are stored in it
+
+			The validator argument is an optional AlignmentValidator object. When provided, the file is always parsed with read_alignment and its problems are recorded in the validator instead of stopping the program (see the validate_alignments function)
+
+			With verbose=False, the warnings of the storage engines about files that are kept in a different storage are not printed """
 
 		self.log_progression = Progression()
 
@@ -44,25 +69,32 @@ class Alignment (Base,MissingFilter):
 		if type(input_alignment) is str:
 
 			self.input_alignment = input_alignment
-			# Get alignment format and code. Sequence code is a tuple of (DNA, N) or (Protein, X)
-			self.input_format, self.sequence_code = self.autofinder (input_alignment)
 
-			# In case the input format is specified, overwrite the attribute
-			if input_format != None:
-				self.input_format = input_format
-
-			# parsing the alignment and getting the basic class attributes
-			# Three attributes will be assigned: alignment, model and locus_length
-			self.read_alignment (input_alignment, self.input_format)
+			# parsing the alignment and getting the basic class attributes. The format is detected from the file header, unless it is specified
+			# Five attributes will be assigned: alignment, model, locus_length, input_format and sequence_code
+			if validator is not None:
+				self.read_alignment (input_alignment, input_format, validator=validator)
+			elif storage == "mmap":
+				self.read_mapped (input_alignment, input_format, verbose)
+			elif storage == "lazy":
+				self.read_indexed (input_alignment, input_format, verbose)
+			elif cache is not None and self.read_cache (input_alignment, cache, input_format):
+				self._set_storage(storage, verbose)
+			else:
+				self.read_alignment (input_alignment, input_format)
+				if cache is not None:
+					cache.store(input_alignment, self)
+				self._set_storage(storage, verbose)
 
 		# In case the class is initialized with a dictionay object
-		elif type(input_alignment) is OrderedDict:
+		elif type(input_alignment) in [OrderedDict, CharacterMatrix, PackedMatrix]:
 
 			self.input_alignment = alignment_name # The name of the alignment (str)
 			self._init_dicObj(input_alignment) # Gets several attributes from the dictionary alignment 
 			self.input_format = input_format # The input format of the alignment (str)
 			self.model = model_list # A list containing the alignment model(s) (list)
 			self.loci_ranges = loci_ranges # A list containing the ranges of the alignment, in case it's a concatenation
+			self._set_storage(storage, verbose)
 
 	def _set_loci_ranges (self, loci_list):
 		""" Use this function to mannyally set the list with the loci ranges """
@@ -87,68 +119,144 @@ class Alignment (Base,MissingFilter):
 	def _set_locus_length (self, locus_length):
 		""" Manually sets the length of the locus in the Alignment locus """
 
+	def _set_storage (self, storage, verbose=True):
+		""" Converts the alignment attribute into the specified storage engine ('dict', 'matrix' or 'packed'). Alignments with sequences of unequal length cannot be stored in a matrix or packed, in which case the dictionary storage is kept, with a warning if verbose is True. Other values leave the alignment attribute unchanged """
+
+		if storage == "matrix" and type(self.alignment) is not CharacterMatrix:
+			try:
+				self.alignment = CharacterMatrix(self.alignment)
+			except SequenceLengthError:
+				if verbose == True:
+					print ("\nWARNING: Unequal sequence length in %s. The alignment will not be stored as a character matrix" % (self.input_alignment))
+
+		elif storage == "packed" and type(self.alignment) is not PackedMatrix:
+			try:
+				self.alignment = PackedMatrix(self.alignment)
+			except SequenceLengthError:
+				if verbose == True:
+					print ("\nWARNING: Unequal sequence length in %s. The alignment will not be packed" % (self.input_alignment))
+
+		elif storage == "dict" and type(self.alignment) in [CharacterMatrix, PackedMatrix]:
+			self.alignment = self.alignment.to_dict()
+
+	def _wrap_alignment (self, alignment_dict):
+		""" Returns a newly built alignment dictionary in the same storage engine of the current alignment attribute """
+
+		if type(alignment_dict) is type(self.alignment):
+			return alignment_dict
+
+		try:
+			if type(self.alignment) is CharacterMatrix:
+				return CharacterMatrix(alignment_dict)
+			elif type(self.alignment) is PackedMatrix:
+				return PackedMatrix(alignment_dict)
+		except SequenceLengthError:
+			pass
+
+		return alignment_dict
+
 	def _init_dicObj (self, dictionary_obj):
 		""" In case the class is initialized with a dictionary as input, this function will retrieve the same information as the read_alignment function would do  """
 
-		self.sequence_code = self.guess_code(list(dictionary_obj.values())[0])
+		first_sequence = next(iter(dictionary_obj.values()))
+		self.sequence_code = self.guess_code(first_sequence)
 		self.alignment = dictionary_obj
-		self.locus_length = len(list(dictionary_obj.values())[0])
+		self.locus_length = len(first_sequence)
 
-	def read_alignment (self, input_alignment, alignment_format, size_check=True):
-		""" The read_alignment method is run when the class is initialized to parse an alignment an set all the basic attributes of the class.
+	def read_alignment (self, input_alignment, alignment_format=None, size_check=True, validator=None):
+		""" The read_alignment method is run when the class is initialized to parse an alignment an set all the basic attributes of the class. The file is read only once, through a buffered stream: the format is detected from the first non-empty line (unless alignment_format is provided) and the genetic code is guessed from the first parsed sequence.
 
 		The 'alignment' variable contains an ordered dictionary with the taxa names as keys and sequences as values
 		The 'model' is an non essential variable that contains a string with a substitution model of the alignment. This only applies to Nexus input formats, as it is the only supported format that contains such information 
-		The 'locus_length' variable contains a int value with the length of the current alignment """
-		
+		The 'locus_length' variable contains a int value with the length of the current alignment
+		The 'input_format' variable contains the format of the file
+		The 'sequence_code' variable contains a tuple of (DNA, n) or (Protein, x)
+
+		Binary alignment files are recognized by their magic string and loaded with the read_binary method
+
+		The rows are validated while they are parsed by an AlignmentValidator object, and all problems of the file are reported together once it is parsed. If a validator is provided, the problems are only recorded in it, without stopping the program, so that the caller can report the problems of several files at once """
+
+		if alignment_format == "binary":
+			return self.read_binary(input_alignment)
+
+		# A large buffer reduces the number of read calls, which are expensive on network storage
+		file_handle, binary = self._open_alignment(input_alignment, buffering=1048576)
+
+		if alignment_format == None and binary == True:
+			file_handle.close()
+			return self.read_binary(input_alignment)
+
+		# Problems are only reported here if the caller does not provide its own validator
+		report = validator is None
+		if validator is None:
+			validator = AlignmentValidator(input_alignment)
+
 		self.alignment = OrderedDict() # Storage taxa names and corresponding sequences in an ordered Dictionary
 		self.model = [] # Only applies for nexus format. It stores any potential substitution model at the end of the file
-		
-		file_handle = open(input_alignment)
+
+		# The first non-empty line is used to detect the format, and it is then fed to the parser of that format
+		header_line = self.first_line(file_handle)
+
+		if alignment_format == None:
+			alignment_format = self.sniff_format(header_line)
+		else:
+			self.check_format(input_alignment, alignment_format, header=header_line)
+
+		self.input_format = alignment_format
 
 		# PARSING PHYLIP FORMAT
 		if alignment_format == "phylip":
-			header = file_handle.readline().split() # Get the number of taxa and sequence length from the file header
-			self.locus_length = int(header[1])
-			for line in file_handle:
-				if line != "":
-					taxa = line.split()[0].replace(" ","")
-					taxa = self.rm_illegal(taxa)
-					try:
-						sequence = line.split()[1].strip().lower()
-					except:
-						sequence = ""
-
-					self.alignment[taxa] = sequence
-					
-					## TO DO: Read phylip interleave
+			try:
+				self.read_phylip(input_alignment, header_line, file_handle, validator)
+			except SequenceLengthError as error:
+				file_handle.close()
+				if report == False:
+					return validator.add_error(error.value)
+				print ("\nInputError: %s. Please verify the file and re-run the program. Exiting...\n" % (error.value))
+				raise SystemExit
 			
 		# PARSING FASTA FORMAT
 		elif alignment_format == "fasta":
-			for line in file_handle:
+			fragments = OrderedDict() # Stores the lines of each sequence, which are joined only once at the end
+			for line in chain([header_line], file_handle):
 				if line.strip().startswith(">"):
-					taxa = line[1:].strip().replace(" ","_")
+					taxa = line.strip()[1:].strip().replace(" ","_")
 					taxa = self.rm_illegal(taxa)
-					self.alignment[taxa] = ""
+					if taxa in fragments:
+						validator.add_duplicate(taxa)
+					fragments[taxa] = []
 				elif line.strip() != "":
-					self.alignment[taxa] += line.strip().lower().replace(" ","")
-			self.locus_length = len(list(self.alignment.values())[0])
+					fragments[taxa].append(line)
+			self._join_fragments(fragments, validator)
+			self.locus_length = len(next(iter(self.alignment.values()), ""))
 			
 		# PARSING NEXUS FORMAT
 		elif alignment_format == "nexus":
+			fragments = OrderedDict() # Stores the sequence blocks of each taxon, which are joined only once at the end
 			counter = 0
+			interleaved = True # Files that do not declare their layout may be interleaved
+			rows = Counter() # Number of rows of each taxon, which is the number of blocks in the interleaved format
 			for line in file_handle:
 				if line.strip().lower() == "matrix" and counter == 0: # Skips the nexus header
 					counter = 1
+				elif line.strip().lower().startswith("format") and counter == 0:
+					layout = re.search(r"interleave\s*(=\s*(\w+))?", line.lower())
+					interleaved = layout is None or layout.group(2) not in ["no", "false"]
 				elif line.strip() == ";" and counter == 1: # Stop parser here
 					counter = 2
 				elif line.strip() != "" and counter == 1: # Start parsing here
-					taxa = line.strip().split()[0].replace(" ","")
-					taxa = self.rm_illegal(taxa)
-					if taxa in self.alignment: # This accomodates for the interleave format
-						self.alignment[taxa] += "".join(line.strip().split()[1:]).lower()
-					else:
-						self.alignment[taxa] = "".join(line.strip().split()[1:]).lower()
+					fields = line.split(None, 1)
+					taxa = self.rm_illegal(fields[0])
+					# In the sequential format, a repeated taxon is duplicated and only its first row is kept
+					if taxa in fragments and interleaved == False:
+						validator.add_duplicate(taxa)
+						continue
+					rows[taxa] += 1
+					if taxa not in fragments:
+						fragments[taxa] = []
+					# In the interleave format, the same taxon will have several blocks
+					if len(fields) == 2:
+						fragments[taxa].append(fields[1])
 						
 				# This bit of code will extract a potential substitution model from the file
 				elif counter == 2 and line.lower().strip().startswith("lset"):
@@ -156,20 +264,261 @@ class Alignment (Base,MissingFilter):
 				elif counter == 2 and line.lower().strip().startswith("prset"):
 					self.model.append(line.strip())
 
-			self.locus_length = len(list(self.alignment.values())[0])
+			# In the interleaved format every taxon has one row per block, so taxa with more rows than the most common number of rows are duplicated. In case of a tie, such as a sequential file with a single duplicated taxon, the smallest number of rows is taken
+			if interleaved == True and rows:
+				frequencies = Counter(rows.values())
+				blocks = min(row_number for row_number, frequency in frequencies.items() if frequency == max(frequencies.values()))
+				for taxa, row_number in rows.items():
+					if row_number > blocks:
+						validator.add_duplicate(taxa)
+
+			self._join_fragments(fragments, validator)
+			self.locus_length = len(next(iter(self.alignment.values()), ""))
+
+		else:
+			file_handle.close()
+			if report == False:
+				return validator.add_error("The format of the alignment file %s could not be recognized" % (input_alignment))
+			print ("\nThe format of the alignment file %s could not be recognized. Please check the file." % (input_alignment))
+			raise SystemExit
+
+		file_handle.close()
+
+		# Reports the empty sequences, sequences of unequal length and duplicated taxa found while parsing
+		if report == True:
+			validator.report(size_check)
+		elif validator.errors(size_check) != []:
+			return
+
+		first_sequence = next(iter(self.alignment.values()), "")
 
+		if report == False and first_sequence.replace("-","") == "":
+			return validator.add_error("Alignment file %s has no sequence or the first sequence is empty" % (input_alignment))
 
-		
-		# Checks the size consistency of the alignment
-		if size_check == True:
-			self.check_sizes (self.alignment, input_alignment)
-		
-		# Checks for duplicate taxa
-		if len(list(self.alignment)) != len(set(list(self.alignment))):
-			taxa = self.duplicate_taxa(taxa_order)
-			self.log_progression("WARNING: Duplicated taxa have been found in file %s (%s). Please correct this problem and re-run the program\n" %(input_alignment,", ".join(taxa)))
+		# Guessing the genetic code from the first sequence. Sequence code is a tuple of (DNA, n) or (Protein, x)
+		self.check_sequence(first_sequence, input_alignment)
+		self.sequence_code = self.guess_code(first_sequence)
+
+	def read_phylip (self, input_alignment, header_line, file_handle, validator=None):
+		""" Parses the rows of a phylip file into the alignment attribute. Both the sequential and interleaved layouts are supported, and in the sequential layout the sequence of each taxon may span several lines. The number of taxa and sites of the header are used to preallocate a single buffer for all sequences, and the length of each row is validated while the file is read. A SequenceLengthError is raised if the rows do not match the header.
+
+		The layout is guessed from the lines that follow the first row: when the first row is shorter than the number of sites and the next line contains a taxon name and a sequence, the file is read as interleaved. If the file cannot be read with the guessed layout, it is read again with the other one """
+
+		try:
+			taxa_number, self.locus_length = [int(field) for field in header_line.split()[:2]]
+		except ValueError:
+			raise SequenceLengthError("File %s does not start with a phylip header" % (input_alignment))
+
+		# Guessing the layout requires the first two lines of the matrix, which are then fed back to the parser
+		first_lines = []
+		for line in file_handle:
+			if line.strip() != "":
+				first_lines.append(line)
+				if len(first_lines) == 2:
+					break
+
+		first_row = first_lines[0].split(None, 1) if first_lines else []
+		interleaved = taxa_number > 1 and len(first_row) == 2 and len(first_row[1].translate(whitespace_table)) < self.locus_length and len(first_lines) == 2 and len(first_lines[1].split()) >= 2
+
+		try:
+			taxa, sequences = self._parse_phylip_rows(chain(first_lines, file_handle), taxa_number, self.locus_length, interleaved, input_alignment)
+		except SequenceLengthError:
+			# The second attempt re-reads the file, skipping its header
+			retry_handle = open(input_alignment, buffering=1048576)
+			self.first_line(retry_handle)
+			try:
+				taxa, sequences = self._parse_phylip_rows(retry_handle, taxa_number, self.locus_length, not interleaved, input_alignment)
+			finally:
+				retry_handle.close()
+
+		for row, taxon in enumerate(taxa):
+			if validator is not None:
+				validator.add_sequence(taxon, self.locus_length)
+			self.alignment[taxon] = sequences[row*self.locus_length:(row+1)*self.locus_length].decode("ascii")
+
+	def _parse_phylip_rows (self, lines, taxa_number, locus_length, interleaved, input_alignment):
+		""" Supports the read_phylip method by reading the rows of a phylip matrix with a given layout. The sequence characters are copied into a preallocated buffer with one slot of locus_length bytes per taxon. Returns the list of taxa names and the lowercase buffer """
+
+		sequences = bytearray(taxa_number * locus_length)
+		filled = [0] * taxa_number # Number of characters read for each taxon
+		taxa = []
+		row = -1
+
+		for line in lines:
+
+			if line.strip() == "":
+				continue
+
+			# Lines that start a new taxon: every line until all taxa are named in the interleaved layout, or every line after a complete sequence in the sequential layout
+			if (interleaved and len(taxa) < taxa_number) or (not interleaved and (row == -1 or filled[row] == locus_length)):
+				fields = line.split(None, 1)
+				if len(taxa) == taxa_number:
+					raise SequenceLengthError("File %s contains more rows than the %s taxa of its header" % (input_alignment, taxa_number))
+				taxa.append(self.rm_illegal(fields[0]))
+				row = len(taxa) - 1
+				sequence = fields[1] if len(fields) == 2 else ""
+
+			# Lines that continue a sequence: the next taxon of the block in the interleaved layout, or the current taxon in the sequential layout
+			else:
+				if interleaved:
+					row = (row + 1) % taxa_number
+				sequence = line
+
+			sequence = sequence.translate(whitespace_table).encode("ascii")
+			start = row * locus_length + filled[row]
+			filled[row] += len(sequence)
+
+			if filled[row] > locus_length:
+				raise SequenceLengthError("The sequence of taxon %s in file %s is longer than the %s sites of its header" % (taxa[row], input_alignment, locus_length))
+
+			sequences[start:start+len(sequence)] = sequence
+
+		if len(taxa) != taxa_number:
+			raise SequenceLengthError("File %s contains %s taxa, but its header declares %s" % (input_alignment, len(taxa), taxa_number))
+
+		incomplete_taxa = [taxon for taxon, length in zip(taxa, filled) if length != locus_length]
+		if incomplete_taxa != []:
+			raise SequenceLengthError("The sequences of the following taxa in file %s do not have the %s sites of its header: %s" % (input_alignment, locus_length, " ".join(incomplete_taxa)))
+
+		return taxa, sequences.lower()
+
+	def read_cache (self, input_alignment, cache, alignment_format=None):
+		""" Alternative to read_alignment that sets the alignment, model, locus_length, input_format and sequence_code attributes from an AlignmentCache object. Returns False, without setting any attribute, if the file is not in the cache or was cached from a different format than alignment_format """
+
+		cached = cache.load(input_alignment)
+
+		if cached is None:
+			return False
+
+		taxa, sequences, attributes = cached
+
+		if alignment_format is not None and attributes["input_format"] != alignment_format:
+			return False
+
+		self.alignment = OrderedDict((taxon, sequence.decode("ascii")) for taxon, sequence in zip(taxa, sequences))
+		self.input_format = attributes["input_format"]
+		self._set_attributes(attributes)
+
+		return True
+
+	def read_binary (self, input_alignment):
+		""" Alternative to read_alignment for binary alignment files (see the Binary module), which are decoded into memory. Besides the basic attributes, the loci_ranges and restriction_range attributes are restored when they were saved with the alignment """
+
+		try:
+			header, sequences = Binary.read_binary(input_alignment)
+		except SequenceLengthError as error:
+			print ("\nInputError: %s. Please verify the file and re-run the program. Exiting...\n" % (error.value))
 			raise SystemExit
-		
+
+		self.alignment = OrderedDict((taxon, sequence.decode("ascii")) for taxon, sequence in zip(header["taxa"], sequences))
+		self.input_format = "binary"
+		self._set_attributes(header["attributes"])
+
+	def _set_attributes (self, attributes):
+		""" Sets the sequence_code, model and locus_length attributes, and optionally the loci_ranges and restriction_range attributes, from the dictionary of attributes of a binary alignment """
+
+		self.sequence_code = tuple(attributes["sequence_code"])
+		self.model = attributes["model"]
+		self.locus_length = attributes["locus_length"]
+
+		if attributes.get("loci_ranges") is not None:
+			self.loci_ranges = [tuple(loci_range) for loci_range in attributes["loci_ranges"]]
+
+		if attributes.get("restriction_range") is not None:
+			self.restriction_range = attributes["restriction_range"]
+
+	def _open_alignment (self, input_alignment, buffering=-1):
+		""" Opens an alignment file as a text stream and returns it along with whether the file starts with the magic string of the binary format. The magic string is peeked from the buffer of the underlying binary stream, so that each file is opened only once to be recognized and parsed """
+
+		binary_handle = open(input_alignment, "rb", buffering=buffering)
+		binary = Binary.is_binary(binary_handle)
+
+		return io.TextIOWrapper(binary_handle), binary
+
+	def read_mapped (self, input_alignment, alignment_format=None, verbose=True):
+		""" Alternative to read_alignment for the 'mmap' storage. Sequential phylip and binary files are memory-mapped, and only the position of each taxon sequence is indexed, so that the sequences are not copied into memory. Files in other formats, or phylip files whose sequences span several lines, are parsed with read_alignment """
+
+		file_handle, binary = self._open_alignment(input_alignment)
+		header_line = self.first_line(file_handle) if binary == False else ""
+		file_handle.close()
+
+		if alignment_format in [None, "binary"] and binary == True:
+			try:
+				self.alignment = MappedBinary(input_alignment)
+			except SequenceLengthError as error:
+				print ("\nInputError: %s. Please verify the file and re-run the program. Exiting...\n" % (error.value))
+				raise SystemExit
+
+			self.input_format = "binary"
+			self._set_attributes(self.alignment.header["attributes"])
+			return
+
+		if alignment_format in [None, "phylip"] and self.sniff_format(header_line) == "phylip":
+			try:
+				self.alignment = MappedPhylip(input_alignment, taxa_filter=self.rm_illegal)
+			except SequenceLengthError:
+				if verbose == True:
+					print ("\nWARNING: %s is not a sequential phylip file with one row per taxon and will be loaded into memory" % (input_alignment))
+				return self.read_alignment(input_alignment, alignment_format)
+		else:
+			return self.read_alignment(input_alignment, alignment_format)
+
+		self.input_format = "phylip"
+		self.model = []
+		self.locus_length = self.alignment.locus_length
+
+		# Guessing the genetic code from the first sequence. Sequence code is a tuple of (DNA, n) or (Protein, x)
+		first_sequence = next(iter(self.alignment.values()), "")
+		self.check_sequence(first_sequence, input_alignment)
+		self.sequence_code = self.guess_code(first_sequence)
+
+	def read_indexed (self, input_alignment, alignment_format=None, verbose=True):
+		""" Alternative to read_alignment for the 'lazy' storage. The taxa and the position of their sequences in the file are indexed with an IndexedAlignment object, and only the first sequence is read, to guess the genetic code. Binary files are memory-mapped as in the read_mapped method, and interleaved files are parsed with read_alignment """
+
+		file_handle, binary = self._open_alignment(input_alignment)
+
+		if alignment_format in [None, "binary"] and binary == True:
+			file_handle.close()
+			return self.read_mapped(input_alignment, alignment_format, verbose)
+
+		header_line = self.first_line(file_handle)
+		file_handle.close()
+
+		if alignment_format == None:
+			alignment_format = self.sniff_format(header_line)
+		else:
+			self.check_format(input_alignment, alignment_format, header=header_line)
+
+		validator = AlignmentValidator(input_alignment)
+
+		try:
+			self.alignment = IndexedAlignment(input_alignment, alignment_format, taxa_filter=self.rm_illegal, validator=validator)
+		except SequenceLengthError:
+			if verbose == True:
+				print ("\nWARNING: %s cannot be indexed and will be loaded into memory" % (input_alignment))
+			return self.read_alignment(input_alignment, alignment_format)
+
+		# Reports the empty sequences, sequences of unequal length and duplicated taxa found while indexing, as in read_alignment
+		validator.report()
+
+		self.input_format = alignment_format
+		self.model = self.alignment.model
+		self.locus_length = self.alignment.locus_length
+
+		# Guessing the genetic code from the first sequence. Sequence code is a tuple of (DNA, n) or (Protein, x)
+		first_sequence = next(iter(self.alignment.values()), "")
+		self.check_sequence(first_sequence, input_alignment)
+		self.sequence_code = self.guess_code(first_sequence)
+
+	def _join_fragments (self, fragments, validator=None):
+		""" Joins the lines of each sequence, collected by the parsers, into the alignment attribute. The whitespace removal and lowercasing are made in bulk on the joined sequence. The fragments of each taxon are released as soon as its sequence is built, and the length of the sequence is recorded in the validator, if provided """
+
+		while fragments:
+			taxa, sequence_fragments = fragments.popitem(last=False)
+			self.alignment[taxa] = "".join(sequence_fragments).translate(whitespace_table).lower()
+			if validator is not None:
+				validator.add_sequence(taxa, len(self.alignment[taxa]))
+
 	def iter_taxa (self):
 		""" Returns a list with the taxa contained in the alignment """
 
@@ -185,57 +534,96 @@ class Alignment (Base,MissingFilter):
 		return sequences
 
 	def remove_taxa (self, taxa_list_file):
-		""" Removes specified taxa from the alignment. As taxa_list, this method supports a python list or an input csv file with a single column containing the unwanted species in separate lines """
+		""" Removes specified taxa from the alignment. As taxa_list, this method supports a python list or set, or a list whose first element is an input csv file with a single column containing the unwanted species in separate lines """
 
-		def remove (taxa_list):
+		taxa_set = read_taxa_list(taxa_list_file)
 
-			new_alignment = OrderedDict()
+		# Deleting the taxa in place keeps the storage engine of the alignment, and in a matrix or memory-mapped file only the taxon index is modified
+		for taxa in [taxa for taxa in self.alignment if taxa in taxa_set]:
+			del self.alignment[taxa]
 
-			for taxa,seq in self.alignment.items():
-				if taxa not in taxa_list:
-					new_alignment[taxa] = seq
+	def keep_taxa (self, taxa_list_file):
+		""" Removes all taxa from the alignment except the specified ones, which are provided as in the remove_taxa method. Taxa of the list that are not present in the alignment are ignored, but the program exits if none of them is present """
 
-			self.alignment = new_alignment
+		taxa_set = read_taxa_list(taxa_list_file)
 
-		# Checking if taxa_list is an input csv file:
-		try:
-			file_handle = open(taxa_list_file[0])
+		if not any(taxa in taxa_set for taxa in self.alignment):
+			alignment_name = "the concatenated alignment" if self.input_alignment is None else "the alignment %s" % (self.input_alignment)
+			print ("\nInputError: None of the taxa to keep is present in %s. Please check the taxa names and re-run the program. Exiting...\n" % (alignment_name))
+			raise SystemExit
 
-			taxa_list = []
+		for taxa in [taxa for taxa in self.alignment if taxa not in taxa_set]:
+			del self.alignment[taxa]
 
-			for line in file_handle:
-				taxa_list.append(line.strip())
-		# If not, then the method's argument is already the final list
-		except:
-			taxa_list = taxa_list_file
 
-		remove (taxa_list)
+	def collapse (self, write_haplotypes=True, haplotypes_file=None, stream=False):
+		""" Collapses equal sequences into haplotypes. This method changes the alignment variable and only returns a dictionary with the correspondance between the haplotypes and the original taxa names
+
+		Sequences are grouped by a fixed-size digest, and the full sequences are only compared with the haplotypes of the same digest, to rule out collisions. Only the digests and the name of a representative taxon of each haplotype are kept, instead of the sequences. When stream is True, the correspondance between haplotypes and taxa is written to the haplotypes file as each taxon is collapsed, with one line per taxon, and it is not kept in memory """
+
+		haplotypes = OrderedDict() # Stores the representative taxon (the first one) of each haplotype
+		digest_index = {} # Stores the haplotypes of each digest
+		correspondance_dic = OrderedDict()
+
+		if write_haplotypes == True:
+			# If no output file for the haplotype correspondance is provided, use the input alignment name as reference
+			if haplotypes_file == None:
+				haplotypes_file = self.input_alignment.split(".")[0]
+			if stream == True:
+				output_handle = open(haplotypes_file+".haplotypes","w")
+
+		# Packed sequences can be compared without being decoded
+		if hasattr(self.alignment, "packed_row"):
+			sequence_key = self.alignment.packed_row
+		else:
+			sequence_key = self._sequence_bytes
 
+		for taxa in self.alignment:
 
-	def collapse (self, write_haplotypes=True, haplotypes_file=None):
-		""" Collapses equal sequences into haplotypes. This method changes the alignment variable and only returns a dictionary with the correspondance between the haplotypes and the original taxa names  """
+			sequence = sequence_key(taxa)
+			digest = hashlib.blake2b(sequence, digest_size=16).digest()
 
-		collapsed_dic, correspondance_dic = OrderedDict(), OrderedDict()
-		counter = 1
+			if digest not in digest_index:
+				digest_index[digest] = []
 
-		for taxa, seq in self.alignment.items():
-			if seq in collapsed_dic:
-				collapsed_dic[seq].append(taxa)
+			for haplotype in digest_index[digest]:
+				if sequence_key(haplotypes[haplotype]) == sequence:
+					break
 			else:
-				collapsed_dic[seq] = [taxa]
+				haplotype = "Hap_%s" % (len(haplotypes)+1)
+				haplotypes[haplotype] = taxa
+				digest_index[digest].append(haplotype)
+
+			if stream == True:
+				if write_haplotypes == True:
+					output_handle.write("%s: %s\n" % (haplotype, taxa))
+			elif haplotype in correspondance_dic:
+				correspondance_dic[haplotype].append(taxa)
+			else:
+				correspondance_dic[haplotype] = [taxa]
 
-		self.alignment = OrderedDict()
-		for seq, taxa_list in collapsed_dic.items():
-			haplotype = "Hap_%s" % (counter)
-			self.alignment[haplotype] = seq
-			correspondance_dic[haplotype] = taxa_list
-			counter += 1
+		# The first taxon of each haplotype is used as its representative sequence
+		if hasattr(self.alignment, "take_rows"):
+			self.alignment = self.alignment.take_rows(list(haplotypes.values()), names=list(haplotypes))
+		else:
+			self.alignment = OrderedDict((haplotype, self.alignment[taxa]) for haplotype, taxa in haplotypes.items())
 
 		if write_haplotypes == True:
-			# If no output file for the haplotype correspondance is provided, use the input alignment name as reference
-			if haplotypes_file == None:
-				haplotypes_file = self.input_alignment.split(".")[0]
-			self._write_loci_correspondance(correspondance_dic, haplotypes_file)
+			if stream == True:
+				output_handle.close()
+			else:
+				self._write_loci_correspondance(correspondance_dic, haplotypes_file)
+
+	def _sequence_bytes (self, taxon, alignment=None):
+		""" Returns the sequence of a taxon as a bytes object. When the storage engine supports it, the sequence is not decoded into a string. By default, the sequence is taken from the alignment attribute, but another alignment dictionary can be provided """
+
+		if alignment is None:
+			alignment = self.alignment
+
+		if hasattr(alignment, "row_bytes"):
+			return alignment.row_bytes(taxon)
+		else:
+			return alignment[taxon].encode("ascii")
 
 	def _write_loci_correspondance (self, dic_obj, output_file):
 		""" This function supports the collapse method by writing the correspondance between the unique haplotypes and the loci into a new file """
@@ -247,69 +635,94 @@ class Alignment (Base,MissingFilter):
 
 		output_handle.close()
 
+	def _sequence_slice (self, taxon, start, end):
+		""" Returns a slice of the sequence of a taxon. When the storage engine supports it, only the slice is read, instead of the whole sequence """
+
+		if hasattr(self.alignment, "sequence_slice"):
+			return self.alignment.sequence_slice(taxon, start, end)
+		else:
+			return self.alignment[taxon][start:end]
+
 	def reverse_concatenate (self, partition_obj):
 		""" This function divides a concatenated file according previously defined partitions and returns an AlignmentList object """
 
-		alignment_list, models, names = [], [], []
+		alignmentlist_obj = AlignmentList (list(self.iter_partitions(partition_obj)))
 
-		for model, name, part_range in partition_obj.partitions:
-			partition_dic = OrderedDict()
-			for taxon, seq in self.alignment.items():
-				sub_seq = seq[int(part_range[0])-1:int(part_range[1])-1]
-				if sub_seq.replace(self.sequence_code[1],"") != "":
-					partition_dic[taxon] = sub_seq
-			alignment_list.append(partition_dic)
-			models.append(model)
-			names.append(name)
+		return alignmentlist_obj
 
-		alignmentlist_obj = AlignmentList (alignment_list, model_list=models, name_list=names)
+	def iter_partitions (self, partition_obj):
+		""" Generator that divides a concatenated file according to previously defined partitions, yielding an Alignment object for each partition. The concatenated alignment is first read in a single pass, one taxon row at a time, to find the taxa with data in each partition: slices with only missing data are detected by counting the missing characters of the row, without copying them. Each partition is then built from the slices of those taxa only when it is yielded, so that the memory used never exceeds the size of the concatenated alignment plus one partition """
 
-		return alignmentlist_obj
+		missing = self.sequence_code[1]
+
+		# Partition ranges are 1-based and inclusive
+		partition_ranges = [(int(part_range[0])-1, int(part_range[1])) for model, name, part_range in partition_obj.partitions]
+		partition_taxa = [[] for part_range in partition_ranges]
+
+		for taxon, row in self.alignment.items():
+			for (start, end), taxa_list in zip(partition_ranges, partition_taxa):
+				if row.count(missing, start, end) != end - start:
+					taxa_list.append(taxon)
+
+		for (model, name, part_range), (start, end), taxa_list in zip(partition_obj.partitions, partition_ranges, partition_taxa):
+
+			if taxa_list:
+				partition_dic = OrderedDict((taxon, self._sequence_slice(taxon, start, end)) for taxon in taxa_list)
+				yield Alignment(partition_dic, model_list=[model], alignment_name=name.strip())
+			else:
+				print ("\nWARNING: Partition %s only contains missing data and will not be written" % (name.strip()))
 
 	def code_gaps (self):
-		""" This method codes gaps present in the alignment in binary format, according to the method of Simmons and Ochoterena (2000), to be read by phylogenetic programs such as MrBayes. The resultant alignment, however, can only be outputed in the Nexus format """
-
-		def gap_listing (sequence,gap_symbol="-"):
-			""" Function that parses a sequence string and returns the position of indel events. The returned list is composed of tuples with the span of each indel """
-			gap = "%s+" % (gap_symbol)
-			span_regex = ""
-			gap_list,seq_start = [],0
-			while span_regex != None:
-				span_regex = re.search(gap,sequence)
-				if span_regex != None and seq_start == 0:
-					gap_list.append(span_regex.span())
-					sequence = sequence[span_regex.span()[1]+1:]
-					seq_start = span_regex.span()[1]+1
-				elif span_regex != None and seq_start != 0:
-					gap_list.append((span_regex.span()[0]+seq_start,span_regex.span()[1]+seq_start))
-					sequence = sequence[span_regex.span()[1]+1:]
-					seq_start += span_regex.span()[1]+1
-			return gap_list
-
-		def gap_binary_generator (sequence,gap_list):
-			""" This function contains the algorithm to construct the binary state block for the indel events """
-			for cur_gap in gap_list:
-				cur_gap_start,cur_gap_end = cur_gap
-				if sequence[cur_gap_start:cur_gap_end] == "-"*(cur_gap_end - cur_gap_start) and sequence[cur_gap_start-1] != "-" and sequence[cur_gap_end] != "-":
-					sequence += "1"
-				elif sequence[cur_gap_start:cur_gap_end] == "-"*(cur_gap_end - cur_gap_start):
-					if sequence[cur_gap_start-1] == "-" or sequence[cur_gap_end] == "-":
-						sequence += "-"
-				elif sequence[cur_gap_start:cur_gap_end] != "-"*(cur_gap_end - cur_gap_start):
-					sequence += "0"
-			return sequence
-
-		complete_gap_list = []
-
-		# Get the complete list of unique gap positions in the alignment
+		""" This method codes gaps present in the alignment in binary format, according to the method of Simmons and Ochoterena (2000), to be read by phylogenetic programs such as MrBayes. The resultant alignment, however, can only be outputed in the Nexus format
+
+		For each unique indel event, a taxon is coded as '1' if it has a gap with exactly the same span, '-' if the span is part of a larger gap and '0' otherwise. The indels of each sequence are found in a single scan, and the code of every indel is obtained from the cumulative gap count of the sequence, so that the time is linear on the number of taxa times the number of unique indels """
+
+		gap_pattern = re.compile("-+")
+
+		# Get the complete list of unique gap positions in the alignment. The keys of the dictionary are used as an ordered set, which keeps the order in which the gaps are found
+		unique_gaps = OrderedDict()
 		for taxa, seq in self.alignment.items():
+			for gap in gap_pattern.finditer(seq):
+				unique_gaps[gap.span()] = None
 
-			current_list = gap_listing (seq)
-			complete_gap_list += [gap for gap in current_list if gap not in complete_gap_list]
+		complete_gap_list = list(unique_gaps)
 
 		# This will add the binary matrix of the unique gaps listed at the end of each alignment sequence
-		for taxa, seq in self.alignment.items():
-			self.alignment[taxa] = gap_binary_generator (seq, complete_gap_list)
+		coded_alignment = OrderedDict()
+
+		if np is not None:
+			gap_starts = np.array([gap[0] for gap in complete_gap_list], dtype=np.int64)
+			gap_ends = np.array([gap[1] for gap in complete_gap_list], dtype=np.int64)
+			binary_states = np.array([ord("0"), ord("-"), ord("1")], dtype=np.uint8)
+
+			for taxa, seq in self.alignment.items():
+				gaps = np.frombuffer(seq.encode("ascii"), dtype=np.uint8) == ord("-")
+				gap_counts = np.concatenate(([0], np.cumsum(gaps)))
+				# The padding makes the positions before the first and after the last column count as non-gaps
+				padded_gaps = np.concatenate(([False], gaps, [False]))
+
+				full_gap = (gap_counts[gap_ends] - gap_counts[gap_starts]) == (gap_ends - gap_starts)
+				exact_gap = full_gap & ~padded_gaps[gap_starts] & ~padded_gaps[gap_ends+1]
+
+				coded_alignment[taxa] = seq + binary_states[full_gap.astype(np.uint8) + exact_gap].tobytes().decode("ascii")
+
+		else:
+			for taxa, seq in self.alignment.items():
+				taxa_gaps = set(gap.span() for gap in gap_pattern.finditer(seq))
+				gap_counts = list(accumulate((char == "-" for char in seq), initial=0))
+
+				binary = []
+				for gap_start, gap_end in complete_gap_list:
+					if (gap_start, gap_end) in taxa_gaps:
+						binary.append("1")
+					elif gap_counts[gap_end] - gap_counts[gap_start] == gap_end - gap_start:
+						binary.append("-")
+					else:
+						binary.append("0")
+
+				coded_alignment[taxa] = seq + "".join(binary)
+
+		self.alignment = self._wrap_alignment(coded_alignment)
 
 		self.restriction_range = "%s-%s" % (int(self.locus_length), len(complete_gap_list) + int(self.locus_length) - 1)
 
@@ -320,12 +733,14 @@ class Alignment (Base,MissingFilter):
 		alignment_filter = MissingFilter(self.alignment, gap_threshold=gap_threshold, missing_threshold=missing_threshold, gap_symbol="-", missing_symbol=self.sequence_code[1])
 
 		# Replace the old alignment by the filtered one
-		self.alignment = alignment_filter.alignment
+		self.alignment = self._wrap_alignment(alignment_filter.alignment)
 		self.locus_length = alignment_filter.locus_length
 
-	def write_to_file (self, output_format, output_file, new_alignment = None, seq_space_nex=40, seq_space_phy=30, seq_space_ima2=10, cut_space_nex=50, cut_space_phy=50, cut_space_ima2=8, form="leave", gap="-", model_phylip="LG", model_list=[], outgroup_list=None):
+	def write_to_file (self, output_format, output_file, new_alignment = None, seq_space_nex=40, seq_space_phy=30, seq_space_ima2=10, cut_space_nex=50, cut_space_phy=50, cut_space_ima2=8, form="leave", gap="-", model_phylip="LG", model_list=[], outgroup_list=None, interleave_width=90):
 		""" Writes the alignment object into a specified output file, automatically adding the extension, according to the output format 
 
+		With form="interleave", the nexus and phylip formats are written in blocks of interleave_width sites.
+
 		This function supports the writting of both converted (no partitions) and concatenated (partitioned files). The choice of this modes is determined by the presence or absence of the loci_range attribute of the object. If its None, there are no partitions and no partitions files will be created. If there are partitions, then the appropriate partitions will be written.
 
 		The outgroup_list argument is used only for Nexus output format and consists in writing a line defining the outgroup. This may be usefull for analyses with MrBayes or other software that may require outgrups"""
@@ -336,32 +751,40 @@ class Alignment (Base,MissingFilter):
 		else:
 			alignment = self.alignment
 
-		# Checks if there is any other format besides Nexus if the alignment's gap have been coded
+		# Checks if there is any other format besides Nexus (or the binary format, which keeps the coded gaps) if the alignment's gap have been coded
 		try:
 			self.restriction_range
-			if output_format != ["nexus"]:
+			if [alignment_format for alignment_format in output_format if alignment_format not in ["nexus", "binary"]] != []:
 				self.log_progression.write("OutputFormatError: Alignments with gaps coded can only be written in Nexus format")
 				return 0
 		except:
 			pass
 
+		# Both formats are written into the same '.phy' file, which would be corrupted by the phylip rows written after the mcmctree file
+		if "phylip" in output_format and "mcmctree" in output_format:
+			raise OutputFormatError("The phylip and mcmctree output formats are both written into a '.phy' file and cannot be selected together")
+
+		# The sequential formats are written together, in a single pass over the alignment in which each sequence is uppercased and encoded only once. This list stores tuples with the output file, the encoded labels of the rows and the encoded footer
+		sequential_files = []
+
+		# The interleaved formats are also written together, sharing the slices of each block. This list stores tuples with the output file, the encoded labels of the rows, whether the labels are repeated in every block and the encoded footer
+		interleaved_files = []
+
 		# Writes file in phylip format
 		if "phylip" in output_format:
 
-			out_file = open(output_file+".phy","w")
-			out_file.write("%s %s\n" % (len(alignment), self.locus_length))
-			for key, seq in alignment.items():
-					out_file.write("%s %s\n" % (key[:cut_space_phy].ljust(seq_space_phy),seq.upper()))
+			out_file = open(output_file+".phy","wb",buffering=1048576)
+			out_file.write(("%s %s\n" % (len(alignment), self.locus_length)).encode("utf-8"))
+			labels = [("%s " % (key[:cut_space_phy].ljust(seq_space_phy))).encode("utf-8") for key in alignment]
 
-			# In case there is a concatenated alignment being written
-			try:
-				self.loci_ranges
-				partition_file = open(output_file+"_part.File","a")
-				for partition,lrange in self.loci_ranges:
-					partition_file.write("%s, %s = %s\n" % (model_phylip,partition,lrange))
-			except: pass
+			# In interleaved phylip files, the taxa names are only written in the first block
+			if form == "interleave":
+				interleaved_files.append((out_file, labels, False, b""))
+			else:
+				sequential_files.append((out_file, labels, b""))
 
-			out_file.close()
+			# In case there is a concatenated alignment being written
+			self._write_partition_file(output_file, model_phylip)
 
 		if "mcmctree" in output_format:
 
@@ -371,10 +794,11 @@ class Alignment (Base,MissingFilter):
 			try:
 				self.loci_ranges
 				for element in self.loci_ranges:
+					# Partition ranges are 1-based and inclusive
 					partition_range = [int(x) for x in element[1].split("-")]
-					out_file.write("%s %s\n" % (taxa_number, (int(partition_range[1])-int(partition_range[0]))))
-					for taxon, seq in self.alignment.items():
-						out_file.write("%s  %s\n" % (taxon[:cut_space_phy].ljust(seq_space_phy),seq[(int(partition_range[0])-1):(int(partition_range[1])-1)].upper()))
+					out_file.write("%s %s\n" % (taxa_number, (partition_range[1]-partition_range[0]+1)))
+					for taxon in self.alignment:
+						out_file.write("%s  %s\n" % (taxon[:cut_space_phy].ljust(seq_space_phy),self._sequence_slice(taxon, partition_range[0]-1, partition_range[1]).upper()))
 			except:
 				out_file.write("%s %s\n" % (taxa_number,self.locus_length))
 				for taxon, seq in self.alignment.items():
@@ -384,87 +808,351 @@ class Alignment (Base,MissingFilter):
 
 		# Writes file in nexus format
 		if "nexus" in output_format:
-
-			out_file = open(output_file+".nex","w")
 			
-			# This writes the output in interleave format
+			out_file = open(output_file+".nex","wb",buffering=1048576)
+			out_file.write(self._nexus_header(len(alignment), gap, interleave=form == "interleave").encode("utf-8"))
+			labels = [("%s " % (key[:cut_space_nex].ljust(seq_space_nex))).encode("utf-8") for key in alignment]
+
+			footer = io.StringIO()
+			footer.write(";\n\tend;")
+			self._write_nexus_footer(footer, outgroup_list)
+
+			# In interleaved nexus files, the taxa names are written in every block
 			if form == "interleave":
-				try:
-					self.restriction_range
-					out_file.write("#NEXUS\n\nBegin data;\n\tdimensions ntax=%s nchar=%s ;\n\tformat datatype=mixed(%s:1-%s, restriction:%s) interleave=yes gap=%s missing=%s ;\n\tmatrix\n" % (len(alignment), self.locus_length, self.sequence_code[0], self.locus_length-1, self.restriction_range, gap, self.sequence_code[1]))
-				except:
-					out_file.write("#NEXUS\n\nBegin data;\n\tdimensions ntax=%s nchar=%s ;\n\tformat datatype=%s interleave=yes gap=%s missing=%s ;\n\tmatrix\n" % (len(alignment), self.locus_length, self.sequence_code[0], gap, sequence_code[1]))
-				counter = 0
-				for i in range (90,self.locus_length,90):
-					for key, seq in alignment.items():
-						out_file.write("%s %s\n" % (key[:cut_space_nex].ljust(seq_space_nex),seq[counter:i].upper()))
+				interleaved_files.append((out_file, labels, True, footer.getvalue().encode("utf-8")))
+			else:
+				sequential_files.append((out_file, labels, footer.getvalue().encode("utf-8")))
+
+		# Writes file in binary format
+		if "binary" in output_format:
+			self._write_binary(output_file+".elc", alignment)
+
+		# Writes file in fasta format
+		if "fasta" in output_format:
+			out_file = open(output_file+".fas","wb",buffering=1048576)
+			labels = [(">%s\n" % (key)).encode("utf-8") for key in alignment]
+			sequential_files.append((out_file, labels, b""))
+
+		# Writes the rows of all sequential formats
+		if sequential_files != []:
+			for position, taxa in enumerate(alignment):
+				sequence = self._sequence_bytes(taxa, alignment).upper()
+				for out_file, labels, footer in sequential_files:
+					out_file.writelines((labels[position], sequence, b"\n"))
+
+			for out_file, labels, footer in sequential_files:
+				out_file.write(footer)
+				out_file.close()
+
+		# Writes the blocks of all interleaved formats. The sequences are uppercased once, and each block is joined into a single buffer before being written
+		if interleaved_files != []:
+			sequences = [self._sequence_bytes(taxa, alignment).upper() for taxa in alignment]
+
+			for start in range(0, self.locus_length, interleave_width):
+				block = [sequence[start:start+interleave_width] for sequence in sequences]
+
+				for out_file, labels, repeat_labels, footer in interleaved_files:
+					if repeat_labels or start == 0:
+						out_file.write(b"".join(chain.from_iterable(zip(labels, block, repeat(b"\n")))) + b"\n")
 					else:
-						out_file.write("\n")
-						counter = i				
+						out_file.write(b"\n".join(block) + b"\n\n")
+
+			for out_file, labels, repeat_labels, footer in interleaved_files:
+				out_file.write(footer)
+				out_file.close()
+
+	def _write_binary (self, output_file, alignment):
+		""" Writes an alignment dictionary into a binary file, together with the attributes of the Alignment object, including the partitions of a concatenated alignment and the range of coded gaps """
+
+		attributes = {"input_format": self.input_format, "sequence_code": list(self.sequence_code), "model": self.model, "locus_length": self.locus_length}
+
+		if getattr(self, "loci_ranges", None) is not None:
+			attributes["loci_ranges"] = self.loci_ranges
+
+		if hasattr(self, "restriction_range"):
+			attributes["restriction_range"] = self.restriction_range
+
+		# The sites of the coded gaps are not included in the locus_length attribute, so the length of the rows is taken from the first sequence
+		taxa = list(alignment)
+		row_length = len(self._sequence_bytes(taxa[0], alignment)) if taxa else 0
+
+		try:
+			Binary.write_binary(output_file, taxa, lambda taxon: self._sequence_bytes(taxon, alignment), row_length, attributes)
+		except SequenceLengthError as error:
+			print ("\nOutputFormatError: %s. Only alignments with sequences of equal length can be written in binary format" % (error.value))
+			raise SystemExit
+
+	def _nexus_header (self, taxa_number, gap="-", interleave=False):
+		""" Returns the header of the data block of a nexus file, up to the matrix command. Alignments with coded gaps are written as mixed data, with the binary characters in a restriction partition """
+
+		try:
+			self.restriction_range
+			return "#NEXUS\n\nBegin data;\n\tdimensions ntax=%s nchar=%s ;\n\tformat datatype=mixed(%s:1-%s, restriction:%s) interleave=yes gap=%s missing=%s ;\n\tmatrix\n" % (taxa_number, self.locus_length, self.sequence_code[0], self.locus_length-1, self.restriction_range, gap, self.sequence_code[1])
+		except AttributeError:
+			return "#NEXUS\n\nBegin data;\n\tdimensions ntax=%s nchar=%s ;\n\tformat datatype=%s interleave=%s gap=%s missing=%s ;\n\tmatrix\n" % (taxa_number, self.locus_length, self.sequence_code[0], "yes" if interleave else "no", gap, self.sequence_code[1])
+
+	def _write_partition_file (self, output_file, model_phylip="LG"):
+		""" Writes the RAxML partition file that accompanies the phylip output of a concatenated alignment """
+
+		try:
+			self.loci_ranges
+			partition_file = open(output_file+"_part.File","w")
+			for partition,lrange in self.loci_ranges:
+				partition_file.write("%s, %s = %s\n" % (model_phylip,partition,lrange))
+			partition_file.close()
+		except: pass
+
+	def _write_nexus_footer (self, out_file, outgroup_list=None):
+		""" Writes the mrbayes blocks that follow the matrix of a nexus file, with the partitions of a concatenated alignment, the outgroup and the substitution models """
+
+		try:
+			self.loci_ranges
+			out_file.write("\nbegin mrbayes;\n")
+			for partition,lrange in self.loci_ranges:
+				out_file.write("\tcharset %s = %s;\n" % (partition,lrange))
+			out_file.write("\tpartition part = %s: %s;\n\tset partition=part;\nend;\n" % (len(self.loci_ranges),", ".join([part[0] for part in self.loci_ranges])))
+		except:pass
+
+		# In case outgroup taxa are specified
+		if outgroup_list != None:
+
+			compliant_outgroups = [taxon for taxon in outgroup_list if taxon in self.iter_taxa()] # This assures that only the outgroups present in the current file are written
+			if compliant_outgroups != []:
+				out_file.write("\nbegin mrbayes;\n\toutgroup %s\nend;\n" % (" ".join(compliant_outgroups)))
+
+			# Concatenates the substitution models of the individual partitions, each applied to the partition of its locus
+			partition_models = self._partition_models()
+			if any(partition_models):
+				out_file.write("begin mrbayes;\n")
+				for loci_number, model in enumerate(partition_models, 1):
+					for model_line in model:
+						fields = model_line.split()
+						out_file.write("\t%s applyto=(%s) %s\n" % (fields[0], loci_number, " ".join(fields[1:])))
+				out_file.write("end;\n")
+
+	def _partition_models (self):
+		""" Returns a list with the substitution model lines (lset and prset) of each partition of the alignment, in the order of the loci_ranges attribute, with an empty list for partitions without a model. The model attribute of a concatenation already has one list per partition, while the model of a single nexus file is a list of lines. In a concatenated nexus file, these lines select their partitions with the applyto option, which is removed from the returned lines """
+
+		partitions_number = len(getattr(self, "loci_ranges", None) or []) or 1
+		models = [[] for partition in range(partitions_number)]
+
+		if all(type(model) is str for model in self.model):
+			for model_line in self.model:
+				if not model_line.lower().startswith(("lset", "prset")):
+					continue
+
+				applyto = re.search(r"\s*applyto\s*=\s*\(([^)]*)\)", model_line, re.IGNORECASE)
+				if applyto is None or applyto.group(1).strip().lower() == "all":
+					partitions = range(partitions_number)
 				else:
-					for key, seq in alignment.items():
-						out_file.write("%s %s\n" % (key[:cut_space_nex].ljust(seq_space_nex),seq[i:self.locus_length].upper()))
-					else:
-						out_file.write("\n")
-				out_file.write(";\n\tend;")
-				
-			# This writes the output in leave format (default)
-			else:
-				try:
-					self.restriction_range
-					out_file.write("#NEXUS\n\nBegin data;\n\tdimensions ntax=%s nchar=%s ;\n\tformat datatype=mixed(%s:1-%s, restriction:%s) interleave=yes gap=%s missing=%s ;\n\tmatrix\n" % (len(alignment), self.locus_length, self.sequence_code[0], self.locus_length-1, self.restriction_range, gap, self.sequence_code[1]))
-				except:
-					out_file.write("#NEXUS\n\nBegin data;\n\tdimensions ntax=%s nchar=%s ;\n\tformat datatype=%s interleave=no gap=%s missing=%s ;\n\tmatrix\n" % (len(alignment), self.locus_length, self.sequence_code[0], gap, self.sequence_code[1]))
-				for key,seq in alignment.items():
-					out_file.write("%s %s\n" % (key[:cut_space_nex].ljust(seq_space_nex),seq))
-				out_file.write(";\n\tend;")
+					partitions = [int(partition) - 1 for partition in applyto.group(1).split(",") if partition.strip().isdigit()]
+					model_line = model_line[:applyto.start()] + model_line[applyto.end():]
 
+				for partition in partitions:
+					if partition < partitions_number:
+						models[partition].append(model_line)
+		else:
+			for partition, model in enumerate(self.model[:partitions_number]):
+				models[partition] = list(model)
 
-			try:
-				self.loci_ranges
-				out_file.write("\nbegin mrbayes;\n")
-				for partition,lrange in self.loci_ranges:
-					out_file.write("\tcharset %s = %s;\n" % (partition,lrange))
-				out_file.write("\tpartition part = %s: %s;\n\tset partition=part;\nend;\n" % (len(self.loci_ranges),", ".join([part[0] for part in self.loci_ranges])))
-			except:pass
-
-			# In case outgroup taxa are specified
-			if outgroup_list != None:
-
-				compliant_outgroups = [taxon for taxon in outgroup_list if taxon in self.iter_sequences()] # This assures that only the outgroups present in the current file are written
-				if compliant_outgroups != []:
-					out_file.write("\nbegin mrbayes;\n\toutgroup %s\nend;\n" % (" ".join(compliant_outgroups)))
-
-				# Concatenates the substitution models of the individual partitions
-				if self.model:
-					loci_number = 1
-					out_file.write("begin mrbayes;\n")
-					for model in self.model:
-						m1 = model[0].split()
-						m2 = model[1].split()
-						m1_final = m1[0]+" applyto=("+str(loci_number)+") "+" ".join(m1[1:])
-						m2_final = m2[0]+" applyto=("+str(loci_number)+") "+" ".join(m2[1:])
-						out_file.write("\t%s\n\t%s\n" % (m1_final, m2_final))
-						loci_number += 1
-					out_file.write("end;\n")
+		return models
 
-			out_file.close()
 
-		# Writes file in fasta format
-		if "fasta" in output_format:
-			out_file = open(output_file+".fas","w")
-			for key,seq in self.alignment.items():
-				out_file.write(">%s\n%s\n" % (key,seq.upper()))				
+def read_taxa_list (taxa_list_file):
+	""" Returns the set of taxa names provided to the remove_taxa and keep_taxa methods, which may be a python list or set, or a list whose first element is a csv file with a single column containing the species in separate lines. Sets are returned unchanged, so that a csv file parsed once can be applied to many alignments. The program exits if a single argument that looks like a file path cannot be opened, instead of using it as a taxon name """
 
-			out_file.close()
+	if type(taxa_list_file) in [set, frozenset]:
+		return taxa_list_file
+
+	# Checking if taxa_list is an input csv file:
+	try:
+		file_handle = open(taxa_list_file[0])
+	# If not, then the method's argument is already the final list
+	except (IndexError, TypeError):
+		return set(taxa_list_file)
+	except OSError as error:
+		if len(taxa_list_file) == 1 and _is_taxa_file(taxa_list_file[0]):
+			print ("\nInputError: The taxa file %s could not be opened (%s). Please check the file name and re-run the program. Exiting...\n" % (taxa_list_file[0], error.strerror))
+			raise SystemExit
+		return set(taxa_list_file)
+
+	taxa_set = set(line.strip() for line in file_handle)
+	taxa_set.discard("")
+
+	file_handle.close()
+
+	return taxa_set
+
+def _is_taxa_file (name):
+	""" Supports the read_taxa_list function by checking if a name looks like the path of a taxa file, that is, if it contains a directory or ends with the extension of a text file """
+
+	return os.sep in name or os.path.splitext(name)[1].lower() in [".csv", ".txt", ".tsv", ".lst", ".list"]
+
+def _load_alignment (arguments):
+	""" Parses a single alignment file in a worker process of the AlignmentList class. Parsing errors terminate with SystemExit, which would kill the worker and block the pool, so they are returned to be raised in the main process """
+
+	alignment_file, storage, cache, verbose, input_format = arguments
+
+	try:
+		return Alignment(alignment_file, input_format=input_format, storage=storage, cache=cache, verbose=verbose)
+	except SystemExit as error:
+		return error
+
+def _conversion_name (alignment_object, output_format):
+	""" Returns the name of the output file of a converted alignment. The "_conv" suffix prevents the input file from being overwritten when it is converted into its own format """
+
+	if alignment_object.input_format in output_format:
+		return alignment_object.input_alignment.split(".")[0]+"_conv"
+	else:
+		return alignment_object.input_alignment.split(".")[0]
+
+def _convert_alignment (arguments):
+	""" Converts a single alignment file from start to end in a worker process of the convert_alignments function: the file is parsed, filtered, the unwanted taxa are removed and the output file(s) are written. Only the name of the input file is returned, so that the alignment is released as soon as it is written. As in _load_alignment, errors that terminate with SystemExit are returned to be raised in the main process """
+
+	alignment_file, storage, cache, output_format, form, interleave_width, outgroup_list, filter_thresholds, taxa_list, keep_list, verbose, input_format = arguments
+
+	try:
+		alignment_object = Alignment(alignment_file, input_format=input_format, storage=storage, cache=cache, verbose=verbose)
+
+		if filter_thresholds is not None:
+			alignment_object.filter_missing_data(filter_thresholds[0], filter_thresholds[1])
+
+		if keep_list is not None:
+			alignment_object.keep_taxa(keep_list)
+
+		if taxa_list is not None:
+			alignment_object.remove_taxa(taxa_list)
+
+		alignment_object.write_to_file(output_format, output_file=_conversion_name(alignment_object, output_format), form=form, outgroup_list=outgroup_list, interleave_width=interleave_width)
+
+	except SystemExit as error:
+		return error
+
+	return alignment_file
+
+def convert_alignments (alignment_list, output_format, form="leave", interleave_width=90, outgroup_list=None, filter_thresholds=None, taxa_list=None, keep_list=None, storage=None, threads=1, verbose=True, cache=None, input_format=None):
+	""" Pipelined conversion of multiple alignment files. Contrary to the AlignmentList class, which parses all files before they are filtered and written, each file is converted independently from the others, so that only the alignments being processed are kept in memory. With threads > 1, the files are distributed among a pool of worker processes and are reported as soon as they are written, regardless of their order. The filter_thresholds argument is an optional tuple with the gap and missing data thresholds, and taxa_list and keep_list the optional lists of taxa (or csv files) to be removed and kept, respectively. The input_format argument is the format of the input files, which is detected for each file if it is None. Returns the list of converted files, in order of completion """
+
+	log_progression = Progression()
+	log_progression.record("Converting file", len(alignment_list))
+
+	# The taxa lists are parsed only once, and the resulting sets are sent to the workers
+	if taxa_list is not None:
+		taxa_list = read_taxa_list(taxa_list)
+
+	if keep_list is not None:
+		keep_list = read_taxa_list(keep_list)
+
+	tasks = ((alignment_file, storage, cache, output_format, form, interleave_width, outgroup_list, filter_thresholds, taxa_list, keep_list, verbose, input_format) for alignment_file in alignment_list)
+
+	if threads > 1:
+		pool = Pool(threads)
+		# The tasks are consumed lazily by imap_unordered and each result is just a file name, so memory does not grow with the number of files
+		chunksize = max(1, min(16, len(alignment_list) // (threads * 4)))
+		results = pool.imap_unordered(_convert_alignment, tasks, chunksize)
+	else:
+		results = map(_convert_alignment, tasks)
 
+	converted_files = []
+
+	for position, result in enumerate(results):
+
+		if verbose == True:
+			log_progression.progress_bar(position+1)
+
+		if type(result) is SystemExit:
+			if threads > 1:
+				pool.terminate()
+			raise result
+
+		converted_files.append(result)
+
+	if threads > 1:
+		pool.close()
+		pool.join()
+
+	return converted_files
+
+def _validate_alignment (arguments):
+	""" Validates a single alignment file in a worker process of the validate_alignments function. Only the lists of errors and warnings are returned, so that the alignment is released as soon as it is parsed """
+
+	alignment_file, alignment_format = arguments
+	validator = AlignmentValidator(alignment_file)
+
+	try:
+		Alignment(alignment_file, input_format=alignment_format, validator=validator)
+	# Errors that are not recorded by the validator, such as a corrupted binary file or a file that cannot be decoded, terminate the parsing of the file but not the validation of the others
+	except SystemExit:
+		validator.add_error("File %s could not be parsed" % (alignment_file))
+	except Exception as error:
+		validator.add_error("%s: %s" % (type(error).__name__, error))
+
+	return alignment_file, validator.errors(), validator.warnings()
+
+def validate_alignments (alignment_list, alignment_format=None, threads=1, verbose=True):
+	""" Checks a list of alignment files without stopping at the first problem. Each file is parsed once, and its empty sequences, sequences of unequal length and duplicated taxa are recorded while the rows are read. With threads > 1, the files are distributed among a pool of worker processes. Returns a list with the file name, errors and warnings of each file with problems, in the order of alignment_list """
+
+	log_progression = Progression()
+	log_progression.record("Validating file", len(alignment_list))
+
+	tasks = ((alignment_file, alignment_format) for alignment_file in alignment_list)
+
+	if threads > 1:
+		pool = Pool(threads)
+		chunksize = max(1, min(64, len(alignment_list) // (threads * 4)))
+		results = pool.imap(_validate_alignment, tasks, chunksize)
+	else:
+		results = map(_validate_alignment, tasks)
+
+	problems = []
+
+	for position, (alignment_file, errors, warnings) in enumerate(results):
+
+		if verbose == True:
+			log_progression.progress_bar(position+1)
+
+		if errors != [] or warnings != []:
+			problems.append((alignment_file, errors, warnings))
+
+	if threads > 1:
+		pool.close()
+		pool.join()
+
+	return problems
+
+def write_validation (problems, files_number, output_file=None, verbose=True):
+	""" Prints the report of the validate_alignments function, with all problems grouped by file and a final summary. Optionally, the problems are also written into output_file as a tab-separated table with the file, the level and the description of each problem. Returns the number of files with errors """
+
+	error_files = len([alignment_file for alignment_file, errors, warnings in problems if errors != []])
+
+	if verbose == True:
+		for alignment_file, errors, warnings in problems:
+			print ("\n%s" % (alignment_file))
+			for error in errors:
+				print ("\tERROR: %s" % (error))
+			for warning in warnings:
+				print ("\tWARNING: %s" % (warning))
+
+		print ("\n%s of %s files have errors and %s have only warnings" % (error_files, files_number, len(problems) - error_files))
+
+	if output_file is not None:
+		out_file = open(output_file, "w")
+		out_file.write("file\tlevel\tproblem\n")
+		for alignment_file, errors, warnings in problems:
+			for level, messages in [("error", errors), ("warning", warnings)]:
+				for message in messages:
+					out_file.write("%s\t%s\t%s\n" % (alignment_file, level, message))
+		out_file.close()
+
+	return error_files
 
 class AlignmentList (Alignment, Base, MissingFilter):
 	""" At the most basic instance, this class contains a list of Alignment objects upon which several methods can be applied. It only requires either a list of alignment files or .
 
 		It inherits methods from Base and Alignment classes for the write_to_file methods """
 
-	def __init__ (self, alignment_list, model_list=None, name_list=None, verbose=True):
+	def __init__ (self, alignment_list, model_list=None, name_list=None, verbose=True, storage=None, threads=1, cache=None, input_format=None):
+		""" The alignment_list argument may contain alignment files, dictionary objects or Alignment objects. The threads argument sets the number of worker processes used to parse the alignment files. The files are parsed concurrently, but the Alignment objects are always stored in the order of alignment_list. The cache argument is an optional AlignmentCache object used to load the alignment files, and input_format the format of the alignment files, which is detected for each file if it is None """
 
 		self.log_progression = Progression()
 
@@ -473,21 +1161,41 @@ class AlignmentList (Alignment, Base, MissingFilter):
 		if type(alignment_list[0]) is str:
 
 			self.log_progression.record("Parsing file", len(alignment_list))
-			for alignment in alignment_list:
+
+			if threads > 1:
+				pool = Pool(threads)
+				# Files are sent to the workers in chunks to reduce the communication overhead with many small files
+				chunksize = max(1, min(64, len(alignment_list) // (threads * 4)))
+				alignment_objects = pool.imap(_load_alignment, [(alignment, storage, cache, verbose, input_format) for alignment in alignment_list], chunksize)
+			else:
+				alignment_objects = (Alignment(alignment, input_format=input_format, storage=storage, cache=cache, verbose=verbose) for alignment in alignment_list)
+
+			for position, alignment_object in enumerate(alignment_objects):
 
 				if verbose == True:
-					self.log_progression.progress_bar(alignment_list.index(alignment)+1)
+					self.log_progression.progress_bar(position+1)
+
+				if type(alignment_object) is SystemExit:
+					pool.terminate()
+					raise alignment_object
 
-				alignment_object = Alignment(alignment)
 				self.alignment_object_list.append(alignment_object)
 
-		elif type(alignment_list[0]) is OrderedDict:
+			if threads > 1:
+				pool.close()
+				pool.join()
+
+		elif type(alignment_list[0]) in [OrderedDict, CharacterMatrix, PackedMatrix]:
 
 			for alignment, model, name in zip(alignment_list, model_list, name_list):
 
-				alignment_object = Alignment(alignment, model_list=[model], alignment_name=name)
+				alignment_object = Alignment(alignment, model_list=[model], alignment_name=name, storage=storage, verbose=verbose)
 				self.alignment_object_list.append(alignment_object)
 
+		elif isinstance(alignment_list[0], Alignment):
+
+			self.alignment_object_list = list(alignment_list)
+
 
 	def _get_format (self):
 		""" Gets the input format of the first alignment in the list """
@@ -497,53 +1205,130 @@ class AlignmentList (Alignment, Base, MissingFilter):
 	def concatenate (self, progress_stat=True):
 		""" The concatenate method will concatenate the multiple sequence alignments and create several attributes 
 
-		This method sets the first three variables below and the concatenation variable containing the dict object"""
+		This method sets the first three variables below and the concatenation variable containing the dict object
+
+		The concatenation is made in two phases. First, the union of the taxa and the range of each locus are collected. Then, the sequence of each taxon is built in a single step, by joining its pieces from all loci once or, when all alignments use the matrix storage, by filling a preallocated matrix. The alignments in the list are not modified
+
+		Alignments of the list that are themselves concatenations (with loci_ranges) keep their partitions, which are shifted to their position in the new concatenation. This allows new loci to be appended to an existing concatenated alignment without parsing its original loci again """
 
 		self.loci_lengths = [] # Saves the sequence lengths of the 
 		self.loci_range = [] # Saves the loci names as keys and their range as values
 		self.models = [] # Saves the substitution models for each one
 
-		self.log_progression.record("Concatenating file",len(self.alignment_object_list))
-		
+		# First phase: collecting the taxa and the loci ranges
+		taxa_order = OrderedDict() # Only the keys are used, as an ordered set of taxa
+		offset = 0
+
 		for alignment_object in self.alignment_object_list:
-			
-			# When set to True, this statement produces a progress status on the terminal
-			if progress_stat == True: 
-				self.log_progression.progress_bar(self.alignment_object_list.index(alignment_object)+1)
-
-			# Setting the missing data symbol
-			missing = alignment_object.sequence_code[1]
-
-			# If input format is nexus, save the substution model, if any
-			if alignment_object.input_format == "nexus" and alignment_object.model != []:
-				self.models.append(alignment_object.model)
-
-			# Algorithm that fills absent taxa with missing data
-			if self.loci_lengths == []:
-				self.concatenation = alignment_object.alignment # Create the main alignment dictionary from the first current alignment and never visit this statement again
-				self.loci_lengths.append(alignment_object.locus_length)
-				self.loci_range.append((alignment_object.input_alignment.split(".")[0],"1-%s" % (alignment_object.locus_length))) # Saving the range for the first loci
-	
+
+			for taxa in alignment_object.alignment:
+				taxa_order[taxa] = None
+
+			loci_ranges = getattr(alignment_object, "loci_ranges", None)
+
+			# The models are saved with one entry per partition, so that each model is applied to the partition of its locus
+			self.models.extend(alignment_object._partition_models())
+
+			if loci_ranges:
+				for partition, lrange in loci_ranges:
+					partition_start, partition_end = [int(position) for position in lrange.split("-")]
+					self.loci_range.append((partition, "%s-%s" % (offset+partition_start, offset+partition_end)))
 			else:
-				for taxa, sequence in alignment_object.alignment.items(): 
-					if taxa in self.concatenation: 
-						self.concatenation[taxa] += sequence # Append the sequence from the current alignment to the respective taxa in the main alignment
-					elif taxa not in self.concatenation:
-						self.concatenation[taxa] = missing*sum(self.loci_lengths)+sequence # If the taxa does not yet exist in the main alignment, create the new entry with a sequence of 'n' characters of the same size as the length of the missed loci and the sequence from the current alignment
-
-				# Saving the range for the subsequent loci
-				self.loci_range.append((alignment_object.input_alignment.split(".")[0],"%s-%s" % (sum(self.loci_lengths)+1, sum(self.loci_lengths)+alignment_object.locus_length)))
-				self.loci_lengths.append(alignment_object.locus_length)
-				
-				# Check if any taxa from the main alignment are missing from the current alignment. If yes, fill them with 'n'
-				for taxa in self.concatenation:
-					if taxa not in alignment_object.alignment: 
-						self.concatenation[taxa] += missing*alignment_object.locus_length
-
-
-		concatenated_alignment = Alignment(self.concatenation, input_format=self._get_format(),model_list=self.models, loci_ranges=self.loci_range)
+				self.loci_range.append((alignment_object.input_alignment.split(".")[0],"%s-%s" % (offset+1, offset+alignment_object.locus_length)))
+
+			self.loci_lengths.append(alignment_object.locus_length)
+			offset += alignment_object.locus_length
+
+		# Second phase: building the concatenated sequences
+		if all(type(alignment_object.alignment) is CharacterMatrix for alignment_object in self.alignment_object_list):
+			self.concatenation = self._fill_matrix(list(taxa_order), progress_stat)
+			storage = "matrix"
+		elif all(type(alignment_object.alignment) is PackedMatrix for alignment_object in self.alignment_object_list):
+			self.concatenation = self._join_loci(list(taxa_order), progress_stat, PackedMatrix())
+			storage = "packed"
+		else:
+			self.concatenation = self._join_loci(list(taxa_order), progress_stat)
+			storage = "dict"
+
+		concatenated_alignment = Alignment(self.concatenation, input_format=self._get_format(),model_list=self.models, loci_ranges=self.loci_range, storage=storage)
 		return concatenated_alignment
 
+	def _join_loci (self, taxa_list, progress_stat=True, concatenation=None):
+		""" Supports the concatenate method by building each concatenated sequence with a single join of the sequences of all loci. Absent taxa are filled with the missing data symbol of each locus. The concatenated sequences are stored in the concatenation argument, which may be an empty PackedMatrix so that each sequence is packed as soon as it is built, or in a new ordered dictionary """
+
+		# The missing data sequence of each locus is created only once and shared by all absent taxa
+		missing_data = [alignment_object.sequence_code[1] * alignment_object.locus_length for alignment_object in self.alignment_object_list]
+
+		if concatenation is None:
+			concatenation = OrderedDict()
+
+		if any(type(alignment_object.alignment) is IndexedAlignment for alignment_object in self.alignment_object_list):
+			return self._join_indexed(taxa_list, missing_data, progress_stat, concatenation)
+
+		alignments = [alignment_object.alignment for alignment_object in self.alignment_object_list]
+
+		self.log_progression.record("Concatenating taxon", len(taxa_list))
+
+		for position, taxa in enumerate(taxa_list):
+
+			# When set to True, this statement produces a progress status on the terminal
+			if progress_stat == True:
+				self.log_progression.progress_bar(position+1)
+
+			concatenation[taxa] = "".join([alignment[taxa] if taxa in alignment else missing for alignment, missing in zip(alignments, missing_data)])
+
+		return concatenation
+
+	def _join_indexed (self, taxa_list, missing_data, progress_stat, concatenation):
+		""" Supports the _join_loci method when some alignments use the 'lazy' storage, whose sequences would otherwise be read from the file one at a time. The loci are read one at a time instead, each with a single open file, and their sequences are appended to the pieces of every taxon before the locus is released. The pieces of each taxon are then joined once """
+
+		fragments = OrderedDict((taxa, []) for taxa in taxa_list)
+
+		self.log_progression.record("Concatenating file", len(self.alignment_object_list))
+
+		for position, (alignment_object, missing) in enumerate(zip(self.alignment_object_list, missing_data)):
+
+			# When set to True, this statement produces a progress status on the terminal
+			if progress_stat == True:
+				self.log_progression.progress_bar(position+1)
+
+			alignment = alignment_object.alignment
+			if type(alignment) is IndexedAlignment:
+				alignment = alignment.to_dict()
+
+			for taxa, sequence_fragments in fragments.items():
+				sequence_fragments.append(alignment[taxa] if taxa in alignment else missing)
+
+		while fragments:
+			taxa, sequence_fragments = fragments.popitem(last=False)
+			concatenation[taxa] = "".join(sequence_fragments)
+
+		return concatenation
+
+	def _fill_matrix (self, taxa_list, progress_stat=True):
+		""" Supports the concatenate method by copying the matrix of each locus into its block of a preallocated character matrix. Absent taxa are filled with the missing data symbol of each locus """
+
+		taxa_index = dict((taxa, row) for row, taxa in enumerate(taxa_list))
+		matrix = np.empty((len(taxa_list), sum(self.loci_lengths)), dtype=np.uint8)
+		offset = 0
+
+		self.log_progression.record("Concatenating file", len(self.alignment_object_list))
+
+		for position, alignment_object in enumerate(self.alignment_object_list):
+
+			# When set to True, this statement produces a progress status on the terminal
+			if progress_stat == True:
+				self.log_progression.progress_bar(position+1)
+
+			locus_end = offset + alignment_object.locus_length
+			rows = [taxa_index[taxa] for taxa in alignment_object.alignment]
+
+			matrix[:, offset:locus_end] = ord(alignment_object.sequence_code[1])
+			matrix[rows, offset:locus_end] = alignment_object.alignment.active_matrix()
+			offset = locus_end
+
+		return CharacterMatrix(matrix=matrix, taxa=taxa_list)
+
 	def iter_alignment_dic (self):
 
 		return [alignment.alignment for alignment in self.alignment_object_list]
@@ -564,22 +1349,190 @@ class AlignmentList (Alignment, Base, MissingFilter):
 			alignment_obj.filter_missing_data(gap_threshold=gap_threshold, missing_threshold=missing_threshold)
 
 	def remove_taxa (self, taxa_list, verbose=False):
-		""" Wrapper of the remove_taxa method of the Alignment object for multiple alignemnts """
+		""" Wrapper of the remove_taxa method of the Alignment object for multiple alignemnts. The taxa list (or csv file) is parsed only once for all alignments """
+
+		taxa_set = read_taxa_list(taxa_list)
+
+		if verbose == True:
+			self.log_progression.write("Removing taxa")
 
 		for alignment_obj in self.alignment_object_list:
+			alignment_obj.remove_taxa(taxa_set)
 
-			if verbose == True:
-				self.log_progression.write("Removing taxa")
+	def keep_taxa (self, taxa_list, verbose=False):
+		""" Wrapper of the keep_taxa method of the Alignment object for multiple alignemnts. The taxa list (or csv file) is parsed only once for all alignments. Alignments without any of the taxa are emptied, and the program exits only if none of the alignments contains them """
+
+		taxa_set = read_taxa_list(taxa_list)
+
+		if not any(taxa in taxa_set for alignment_obj in self.alignment_object_list for taxa in alignment_obj.alignment):
+			print ("\nInputError: None of the taxa to keep is present in the input alignments. Please check the taxa names and re-run the program. Exiting...\n")
+			raise SystemExit
 
-			alignment_obj.remove_taxa(taxa_list)
+		if verbose == True:
+			self.log_progression.write("Extracting taxa")
 
-	def write_to_file (self, output_format, form="leave",outgroup_list=[]):
+		for alignment_obj in self.alignment_object_list:
+			alignment_obj.remove_taxa(set(taxa for taxa in alignment_obj.alignment if taxa not in taxa_set))
+
+	def write_to_file (self, output_format, form="leave",outgroup_list=[], interleave_width=90):
 		""" This method writes a list of alignment objects or a concatenated alignment into a file """
 
 		for alignment_obj in self.alignment_object_list:
-			if alignment_obj.input_format in output_format:
-				output_file_name = alignment_obj.input_alignment.split(".")[0]+"_conv"
-			else:
-				output_file_name = alignment_obj.input_alignment.split(".")[0]
-			alignment_obj.write_to_file(output_format, output_file=output_file_name, form=form, outgroup_list=outgroup_list)
+			alignment_obj.write_to_file(output_format, output_file=_conversion_name(alignment_obj, output_format), form=form, outgroup_list=outgroup_list, interleave_width=interleave_width)
+
+class AlignmentStream (Alignment):
+	""" Concatenates alignment files directly into the output file(s), without holding all loci in memory. A first pass over the files collects the taxa, the loci ranges and the models, from which the position of every taxon row in the output files is determined. In the second pass, the loci are parsed one at a time and their sequences are copied into the rows of memory-mapped output files, so that the peak memory is about the size of a single locus.
+
+	It inherits from the Alignment class the methods to write the partitions of the concatenated alignment. Only sequential nexus, phylip and fasta output formats are supported """
+
+	def __init__ (self, alignment_list, verbose=True, cache=None, input_format=None):
+
+		self.log_progression = Progression()
+		self.alignment_list = alignment_list
+		self.verbose = verbose
+		self.cache = cache
+		self.alignment_format = input_format # The format of the input files, or None to detect it for each file
+
+		self.loci_lengths = [] # Saves the sequence lengths of each locus
+		self.loci_ranges = [] # Saves the loci names and their range
+		self.model = [] # Saves the substitution models of each locus, if any
+
+		taxa_order = OrderedDict() # Only the keys are used, as an ordered set of taxa
+		offset = 0
+
+		# First pass: Only the taxa, length, code and models of each locus are kept
+		self.log_progression.record("Scanning file", len(alignment_list))
+		for position, alignment_file in enumerate(alignment_list):
+
+			if verbose == True:
+				self.log_progression.progress_bar(position+1)
+
+			# Only the taxa are indexed, without loading the sequences. Files that cannot be indexed, such as interleaved files, are silently parsed instead
+			alignment_object = Alignment(alignment_file, input_format=input_format, storage="lazy", verbose=False)
+
+			if position == 0:
+				self.input_format = alignment_object.input_format
+				self.sequence_code = alignment_object.sequence_code
+
+			# One entry per locus, so that each model is applied to the partition of its locus
+			self.model.extend(alignment_object._partition_models())
+
+			for taxa in alignment_object.alignment:
+				taxa_order[taxa] = None
+
+			self.loci_ranges.append((alignment_file.split(".")[0],"%s-%s" % (offset+1, offset+alignment_object.locus_length)))
+			self.loci_lengths.append(alignment_object.locus_length)
+			offset += alignment_object.locus_length
+
+		self.taxa = list(taxa_order)
+		self.locus_length = offset
+		self.input_alignment = None
+
+	def iter_taxa (self):
+		""" Returns a list with the taxa contained in the concatenated alignment """
+
+		return list(self.taxa)
+
+	def remove_taxa (self, taxa_list_file):
+		""" Removes specified taxa from the concatenated alignment. Only the list of taxa is modified, since the sequences are read when the output file is written """
+
+		taxa_set = read_taxa_list(taxa_list_file)
+
+		self.taxa = [taxa for taxa in self.taxa if taxa not in taxa_set]
+
+	def keep_taxa (self, taxa_list_file):
+		""" Removes all taxa from the concatenated alignment except the specified ones. As in remove_taxa, only the list of taxa is modified """
+
+		taxa_set = read_taxa_list(taxa_list_file)
+
+		self.taxa = [taxa for taxa in self.taxa if taxa in taxa_set]
+
+		if self.taxa == []:
+			print ("\nInputError: None of the taxa to keep is present in the input alignments. Please check the taxa names and re-run the program. Exiting...\n")
+			raise SystemExit
+
+	def _map_output (self, output_file, header, prefixes, footer):
+		""" Creates an output file with its final size and returns it, memory-mapped, together with the start position of each taxon row. The header, the row prefixes (taxa names), the newlines and the footer are written immediately, and the sequences are filled in afterwards """
+
+		header, footer = header.encode("utf-8"), footer.encode("utf-8")
+
+		row_starts = []
+		position = len(header)
+		for prefix in prefixes:
+			position += len(prefix.encode("utf-8"))
+			row_starts.append(position)
+			position += self.locus_length + 1
+
+		file_size = position + len(footer)
+
+		file_handle = open(output_file, "w+b")
+		file_handle.truncate(file_size)
+		output_map = mmap.mmap(file_handle.fileno(), file_size)
+
+		output_map[0:len(header)] = header
+		for prefix, row_start in zip(prefixes, row_starts):
+			prefix = prefix.encode("utf-8")
+			output_map[row_start-len(prefix):row_start] = prefix
+			output_map[row_start+self.locus_length:row_start+self.locus_length+1] = b"\n"
+		output_map[file_size-len(footer):file_size] = footer
+
+		return file_handle, output_map, row_starts
+
+	def write_to_file (self, output_format, output_file, seq_space_nex=40, seq_space_phy=30, cut_space_nex=50, cut_space_phy=50, form="leave", gap="-", model_phylip="LG", outgroup_list=None):
+		""" Writes the concatenated alignment into the specified output file(s), automatically adding the extension. The loci are parsed again, one at a time, and each one is written in all output formats at once """
+
+		if form == "interleave" or [output for output in output_format if output not in ["nexus", "phylip", "fasta"]]:
+			raise OutputFormatError("Streaming concatenation only supports sequential nexus, phylip and fasta output formats")
+
+		outputs = [] # Stores tuples with the file handle, memory map and row starts
+
+		if "phylip" in output_format:
+			header = "%s %s\n" % (len(self.taxa), self.locus_length)
+			prefixes = ["%s " % (taxa[:cut_space_phy].ljust(seq_space_phy)) for taxa in self.taxa]
+			outputs.append(self._map_output(output_file+".phy", header, prefixes, ""))
+			self._write_partition_file(output_file, model_phylip)
+
+		if "nexus" in output_format:
+			header = self._nexus_header(len(self.taxa), gap)
+			prefixes = ["%s " % (taxa[:cut_space_nex].ljust(seq_space_nex)) for taxa in self.taxa]
+			footer = io.StringIO()
+			footer.write(";\n\tend;")
+			self._write_nexus_footer(footer, outgroup_list)
+			outputs.append(self._map_output(output_file+".nex", header, prefixes, footer.getvalue()))
+
+		if "fasta" in output_format:
+			prefixes = [">%s\n" % (taxa) for taxa in self.taxa]
+			outputs.append(self._map_output(output_file+".fas", "", prefixes, ""))
+
+		# Second pass: each locus is parsed and copied into its columns of every taxon row
+		offset = 0
+		self.log_progression.record("Concatenating file", len(self.alignment_list))
+		for position, (alignment_file, locus_length) in enumerate(zip(self.alignment_list, self.loci_lengths)):
+
+			if self.verbose == True:
+				self.log_progression.progress_bar(position+1)
+
+			alignment_object = Alignment(alignment_file, input_format=self.alignment_format, cache=self.cache)
+			missing = alignment_object.sequence_code[1] * locus_length
+
+			for row, taxa in enumerate(self.taxa):
+
+				sequence = alignment_object.alignment[taxa] if taxa in alignment_object.alignment else missing
+
+				# A sequence of a different size would overwrite the next locus, or the next row
+				if len(sequence) != locus_length:
+					print ("\nInputError: The sequence of taxon %s in file %s does not have the length of the alignment (%s). Streaming concatenation requires sequences of equal length. Exiting...\n" % (taxa, alignment_file, locus_length))
+					raise SystemExit
+
+				sequence = sequence.encode("ascii").upper()
+
+				for file_handle, output_map, row_starts in outputs:
+					row_start = row_starts[row] + offset
+					output_map[row_start:row_start+locus_length] = sequence
+
+			offset += locus_length
 
+		for file_handle, output_map, row_starts in outputs:
+			output_map.flush()
+			output_map.close()
+			file_handle.close()
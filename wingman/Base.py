@@ -21,51 +21,42 @@
 #  
 
 import sys
+from collections import Counter, OrderedDict
 
 class Base ():
 
-	def autofinder (self, reference_file):
-		""" Autodetects the type of file to be parsed. Based on headers """
-		autofind = "unknown"
-		sequence = ""
-		file_handle = open(reference_file,'r')
-	    
-	    # Skips first empty lines, if any 
+	def first_line (self, file_handle):
+		""" Returns the first non-empty line of an open file handle, or an empty string if the file has no content """
+
 		header = file_handle.readline()
-		while header.startswith("\n"):
-			header = next(file_handle)
-	     
-	    # Recognition of NEXUS files is based on the existence of the string '#NEXUS' in the first non-empty line
-		if header.upper().startswith("#NEXUS"):
-			autofind = "nexus"
-			for line in file_handle:
-				if line.strip().lower() == "matrix":
-					sequence = "".join(file_handle.readline().split()[1:]).strip()
-					break
-
-	    # Recognition of FASTA files is based on the existence of a ">" character as the first character of a non-empty line     
-		elif header.startswith(">"):
-			autofind = "fasta"
-			for line in file_handle:
-				if line.strip() != "" and line.strip()[0] != ">":
-					sequence += line.strip()
-				elif line.strip() != "" and line.strip()[0] == ">":
-					break
-	    
-	    # Recognition of Phylip files is based on the existence of two integers separated by whitespace on the first non-empy line     
+		while header != "" and header.strip() == "":
+			header = file_handle.readline()
+
+		return header
+
+	def sniff_format (self, header):
+		""" Detects the format of an alignment file from its first non-empty line. Returns 'nexus', 'fasta', 'phylip' or 'unknown' """
+
+		# Recognition of NEXUS files is based on the existence of the string '#NEXUS' in the first non-empty line
+		if header.strip().upper().startswith("#NEXUS"):
+			return "nexus"
+
+		# Recognition of FASTA files is based on the existence of a ">" character as the first character of a non-empty line
+		elif header.strip().startswith(">"):
+			return "fasta"
+
+		# Recognition of Phylip files is based on the existence of two integers separated by whitespace on the first non-empy line
 		elif len(header.strip().split()) == 2 and header.strip().split()[0].isdigit() and header.strip().split()[1].isdigit():
-			autofind = "phylip"
-			sequence = "".join(file_handle.readline().split()[1:]).strip()
+			return "phylip"
+
+		return "unknown"
+
+	def check_sequence (self, sequence, reference_file):
+		""" Checks if a reference sequence used to guess the genetic code is not empty """
 
-		# Check if there is any sequence. If not, the alignment file has no sequence
 		if sequence.replace("-","") == "":
 			print ("\nAlignment file %s has no sequence or the first sequence is empty. Please check the file." % (reference_file))
 			raise SystemExit
-		
-		# Guessing the genetic code
-		code = self.guess_code (sequence)
-		
-		return autofind, code
 
 	def partition_format (self, partition_file):
 		""" Tries to guess the format of the partition file (Whether it is Nexus of RAxML's) """
@@ -102,18 +93,17 @@ class Base ():
 
 		return clean_name
 
-	def duplicate_taxa (self, taxa_list):
-		""" Function that identifies duplicated taxa """
-		import collections
-		duplicated_taxa = [x for x, y in collections.Counter(taxa_list).items() if y > 1]
-		return duplicated_taxa
-
-	def check_format (self,input_alignment,alignment_format):
-		""" This function performs some very basic checks to see if the format of the input file is in accordance to the input file format specified when the script is executed """
-		input_handle = open(input_alignment)
-		line = input_handle.readline()
-		while line.strip() == "":
-			line = next(input_handle)
+	def check_format (self,input_alignment,alignment_format,header=None):
+		""" This function performs some very basic checks to see if the format of the input file is in accordance to the input file format specified when the script is executed. If the first non-empty line of the file has already been read, it can be provided with the header argument so that the file is not opened again """
+		if header is None:
+			input_handle = open(input_alignment)
+			header = self.first_line(input_handle)
+			input_handle.close()
+
+		line = header
+		if line.strip() == "":
+			print ("File %s is empty. Please verify the file\nExiting..." % input_alignment)
+			raise SystemExit
 		
 		if alignment_format == "fasta":
 			if line.strip()[0] != ">":
@@ -132,28 +122,94 @@ class Base ():
 				print ("File not in correct Phylip format. First non-empty line of the input file %s does not start with two intergers separated by whitespace. Please verify the file, or the input format settings\nExiting..." % input_alignment)
 				raise SystemExit
 
-	def check_sizes (self, alignment_dic, current_file):
-		""" This will make two sanity checks of the alignment contained in the alignment_dic object: First, it will check if none of the sequences is empty; If True, it will raise an error informing which taxa have empty sequences. If False, this will also test whether all sequences are of the same size and, if not, which are different """
+class AlignmentValidator ():
+	""" Validates an alignment file while it is parsed. The parsers record the length of each sequence and each repeated taxon name as the rows are read, so that the checks take a single pass over the taxa and never compare whole sequences. Empty sequences, duplicated taxa and unreadable files are errors, and sequences that differ from the most common length are warnings """
 
-		# Checking for taxa with empty sequences
-		empty_taxa = []
-		for taxa, seq in alignment_dic.items():
+	def __init__ (self, input_file):
 
-			if seq == "":
-				empty_taxa.append(taxa)
+		self.input_file = input_file
+		self.lengths = OrderedDict() # Saves the sequence length of each taxon
+		self.length_counts = Counter() # Saves the number of sequences of each length
+		self.duplicated_taxa = OrderedDict() # Only the keys are used, as an ordered set of taxa
+		self.parse_errors = [] # Saves the errors that prevented the file from being parsed
 
-		if empty_taxa != []:
+	def add_sequence (self, taxon, length):
+		""" Records the length of the sequence of a taxon. A taxon that was already recorded is reported as duplicated """
 
-			print ("\nInputError: The following taxa contain empty sequences in the file %s: %s\nPlease verify and re-run the program. Exiting...\n" % (current_file," ".join(empty_taxa)))
-			raise SystemExit
+		if taxon in self.lengths:
+			self.add_duplicate(taxon)
+			self.length_counts[self.lengths[taxon]] -= 1
+
+		self.lengths[taxon] = length
+		self.length_counts[length] += 1
+
+	def add_duplicate (self, taxon):
+		""" Records a taxon name that occurs more than once in the file """
+
+		self.duplicated_taxa[taxon] = None
+
+	def add_error (self, message):
+		""" Records an error that prevented the file from being parsed """
+
+		self.parse_errors.append(message)
 
-		# Checking sequence lengths
-		# Determine the most common length 
-		commonSeq = max(set([v for v in alignment_dic.values()]),key=[v for v in alignment_dic.values()].count)
-		# Creates a dictionary with the sequences, and respective length, of different length
-		difLength = dict((key,value) for key, value in alignment_dic.items() if len(commonSeq) != len(value))
-		if difLength != {}:
-			print ("\nWARNING: Unequal sequence lenght detected in %s" % (current_file))
+	def _unique_length_counts (self):
+		""" Returns the number of sequences of each length, without the duplicated taxa, whose sequences may have been merged or replaced by the parsers """
+
+		length_counts = self.length_counts.copy()
+		for taxon in self.duplicated_taxa:
+			if taxon in self.lengths:
+				length_counts[self.lengths[taxon]] -= 1
+
+		return +length_counts
+
+	def common_length (self):
+		""" Returns the most common sequence length of the taxa that are not duplicated, or None if there is no such sequence """
+
+		length_counts = self._unique_length_counts()
+
+		return length_counts.most_common(1)[0][0] if length_counts else None
+
+	def errors (self, size_check=True):
+		""" Returns the list of errors found in the file. The empty sequences are only checked if size_check is True """
+
+		errors = list(self.parse_errors)
+
+		if size_check == True:
+			empty_taxa = [taxon for taxon, length in self.lengths.items() if length == 0]
+			if empty_taxa != []:
+				errors.append("The following taxa contain empty sequences in the file %s: %s" % (self.input_file, " ".join(empty_taxa)))
+
+		if self.duplicated_taxa:
+			errors.append("Duplicated taxa have been found in file %s: %s" % (self.input_file, " ".join(self.duplicated_taxa)))
+
+		return errors
+
+	def warnings (self, size_check=True):
+		""" Returns the list of warnings of the file, which are the sequences whose length differs from the most common length. Empty sequences are reported as errors instead """
+
+		if size_check == False or len(self._unique_length_counts()) < 2:
+			return []
+
+		common_length = self.common_length()
+		unequal_taxa = [taxon for taxon, length in self.lengths.items() if length not in [0, common_length] and taxon not in self.duplicated_taxa]
+
+		if unequal_taxa == []:
+			return []
+
+		return ["Unequal sequence length detected in %s. The following taxa do not have the most common length of %s sites: %s" % (self.input_file, common_length, " ".join(unequal_taxa))]
+
+	def report (self, size_check=True):
+		""" Prints the warnings of the file and, if any error was found, prints all errors together and exits """
+
+		for warning in self.warnings(size_check):
+			print ("\nWARNING: %s" % (warning))
+
+		errors = self.errors(size_check)
+
+		if errors != []:
+			print ("\nInputError: %s\nPlease correct these problems and re-run the program. Exiting...\n" % ("\n".join(errors)))
+			raise SystemExit
 
 class Progression ():
 
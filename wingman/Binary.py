@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#
+#  Copyright 2012 Unknown <diogo@arch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Compact binary encoding of alignments. A binary file starts with a magic string, followed by the length of a JSON header and the header itself, which contains the taxa names, the locus length, the encoding of the sequences and any additional attributes of the alignment. The sequences follow the header, one row per taxon with a fixed size, so that each row can be found without reading the others.
+#
+# Nucleotide sequences whose characters are all IUPAC codes, gaps or missing data are packed in two characters per byte ('4bit' encoding). Other sequences, such as proteins, are stored with one character per byte ('byte' encoding)
+
+from wingman.ErrorHandling import *
+import json
+import os
+import struct
+
+# numpy is optional. When available, the sequences are packed and unpacked with arrays
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+magic = b"ELCBIN\x00\x01"
+
+# The 16 symbols of the '4bit' encoding. The position of each symbol is its code
+nibble_alphabet = b"-acgtrykmswbdhvn"
+
+# Translation table from characters to codes. Characters outside the alphabet are translated into 255
+code_table = bytes(nibble_alphabet.index(bytes([char])) if bytes([char]) in nibble_alphabet else 255 for char in range(256))
+
+# Each packed byte is unpacked into its two characters
+pair_table = [bytes([nibble_alphabet[byte >> 4], nibble_alphabet[byte & 15]]) for byte in range(256)]
+
+# Translation table from codes to characters
+character_table = nibble_alphabet + bytes(240)
+
+def row_size (locus_length, encoding):
+	""" Returns the number of bytes used to store one sequence with the given encoding """
+
+	if encoding == "4bit":
+		return (locus_length + 1) // 2
+
+	return locus_length
+
+def packable (row):
+	""" Returns True if all characters of a sequence (bytes object) belong to the alphabet of the '4bit' encoding """
+
+	return b"\xff" not in row.translate(code_table)
+
+def pack_row (row, encoding):
+	""" Encodes a sequence (bytes object) with the given encoding """
+
+	if encoding == "byte":
+		return row
+
+	codes = row.translate(code_table)
+
+	# Sequences with an odd number of characters are padded with a gap code
+	if len(codes) % 2:
+		codes += b"\x00"
+
+	if np is not None:
+		codes = np.frombuffer(codes, dtype=np.uint8)
+		return ((codes[0::2] << 4) | codes[1::2]).tobytes()
+
+	return bytes((high << 4) | low for high, low in zip(codes[0::2], codes[1::2]))
+
+def unpack_row (data, locus_length, encoding, start=0, end=None):
+	""" Decodes the characters between start and end of a sequence stored with the given encoding. The data argument may be any buffer, such as a memory map, that contains the encoded sequence, and only the bytes of the requested characters are read """
+
+	end = locus_length if end is None else min(end, locus_length)
+	start = min(start, end)
+
+	if encoding == "byte":
+		return bytes(data[start:end])
+
+	packed = data[start // 2:(end + 1) // 2]
+	offset = start % 2
+
+	# The codes are split with array operations and then translated into characters with a translation table
+	if np is not None:
+		packed = np.frombuffer(packed, dtype=np.uint8)
+		codes = np.empty((len(packed), 2), dtype=np.uint8)
+		np.right_shift(packed, 4, out=codes[:, 0])
+		np.bitwise_and(packed, 15, out=codes[:, 1])
+		return codes.tobytes()[offset:offset + end - start].translate(character_table)
+
+	return b"".join(map(pair_table.__getitem__, packed))[offset:offset + end - start]
+
+def write_binary (output_file, taxa, get_row, locus_length, attributes=None):
+	""" Writes an alignment into a binary file. The get_row argument is a function that returns the sequence of a taxon as a bytes object, and attributes is a dictionary with additional JSON serializable attributes of the alignment. The sequences are read twice, first to validate their length and choose the encoding and then to write them, so that they are never all copied into memory. A SequenceLengthError is raised if a sequence does not have locus_length characters. The file is first written with a temporary name and then renamed, so that incomplete files are never read """
+
+	encoding = "4bit"
+
+	for taxon in taxa:
+		row = get_row(taxon)
+
+		if len(row) != locus_length:
+			raise SequenceLengthError("The sequence of taxon %s has %s characters, but the alignment has %s sites" % (taxon, len(row), locus_length))
+
+		if encoding == "4bit" and not packable(row):
+			encoding = "byte"
+
+	header = {"taxa": list(taxa), "locus_length": locus_length, "encoding": encoding, "attributes": attributes or {}}
+	header = json.dumps(header).encode("utf-8")
+
+	# The sequence data starts at a multiple of 8 bytes
+	padding = b"\x00" * (-(len(magic) + 8 + len(header)) % 8)
+
+	temporary_file = "%s.%s.tmp" % (output_file, os.getpid())
+	out_file = open(temporary_file, "wb", buffering=1048576)
+	out_file.write(magic + struct.pack("<Q", len(header)) + header + padding)
+
+	for taxon in taxa:
+		out_file.write(pack_row(get_row(taxon), encoding))
+
+	out_file.close()
+	os.replace(temporary_file, output_file)
+
+def is_binary (input_file):
+	""" Returns True if the file starts with the magic string of the binary format. The file may also be provided as a buffered binary stream at its start, which is peeked without being read, so that it can still be parsed """
+
+	if hasattr(input_file, "peek"):
+		return input_file.peek(len(magic))[:len(magic)] == magic
+
+	file_handle = open(input_file, "rb")
+	file_start = file_handle.read(len(magic))
+	file_handle.close()
+
+	return file_start == magic
+
+def read_header (data, file_name):
+	""" Reads the header of a binary file from a buffer with its contents, such as a memory map. Returns the header dictionary and the position where the sequence data starts. A SequenceLengthError is raised if the buffer does not contain a complete binary alignment """
+
+	if len(data) < len(magic) + 8 or bytes(data[:len(magic)]) != magic:
+		raise SequenceLengthError("File %s is not a binary alignment" % (file_name))
+
+	header_length = struct.unpack("<Q", data[len(magic):len(magic) + 8])[0]
+	header_end = len(magic) + 8 + header_length
+	header = json.loads(bytes(data[len(magic) + 8:header_end]).decode("utf-8"))
+	data_start = header_end + (-header_end % 8)
+
+	if len(data) < data_start + len(header["taxa"]) * row_size(header["locus_length"], header["encoding"]):
+		raise SequenceLengthError("Binary alignment %s is incomplete" % (file_name))
+
+	return header, data_start
+
+def read_binary (input_file):
+	""" Reads a binary file into memory. Returns the header dictionary and a list with the decoded sequences of the taxa, as bytes objects """
+
+	file_handle = open(input_file, "rb")
+	data = file_handle.read()
+	file_handle.close()
+
+	header, data_start = read_header(data, input_file)
+	locus_length, encoding = header["locus_length"], header["encoding"]
+	size = row_size(locus_length, encoding)
+
+	taxa_number = len(header["taxa"])
+
+	# All rows are decoded at once. In the '4bit' encoding, each row is decoded into 2*size characters, which include the padding of odd lengths
+	decoded = unpack_row(data[data_start:data_start + taxa_number * size], taxa_number * size * (2 if encoding == "4bit" else 1), encoding)
+	decoded_size = len(decoded) // taxa_number if taxa_number else 0
+
+	rows = [decoded[row * decoded_size:row * decoded_size + locus_length] for row in range(taxa_number)]
+
+	return header, rows
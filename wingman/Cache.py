@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#
+#  Copyright 2012 Unknown <diogo@arch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+from wingman.ErrorHandling import *
+from wingman import Binary
+import hashlib
+import os
+
+class AlignmentCache ():
+	""" On-disk cache of parsed alignment files. Each parsed file is stored in the compact binary encoding of the Binary module, with the taxa, the packed sequences and the attributes set by the parser (input_format, sequence_code, model and locus_length). Entries are identified by the absolute path, size and modification time of the alignment file, so that a modified file is parsed again. When the cache exceeds max_size (in bytes), the least recently used entries are removed """
+
+	def __init__ (self, cache_directory, max_size=2147483648):
+
+		self.cache_directory = cache_directory
+		self.max_size = max_size
+
+		os.makedirs(cache_directory, exist_ok=True)
+
+	def _entry (self, input_alignment):
+		""" Returns the path of the cache entry of an alignment file """
+
+		file_status = os.stat(input_alignment)
+		key = "%s\0%s\0%s" % (os.path.abspath(input_alignment), file_status.st_size, file_status.st_mtime_ns)
+
+		return os.path.join(self.cache_directory, hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest() + ".elc")
+
+	def load (self, input_alignment):
+		""" Returns a tuple with the taxa list, the list of sequences (bytes objects) and the dictionary of attributes of a cached alignment file, or None if the file is not in the cache. The modification time of the entry is updated, since it records the last use of the entry """
+
+		entry = self._entry(input_alignment)
+
+		try:
+			header, rows = Binary.read_binary(entry)
+			os.utime(entry)
+		# Missing, incomplete or corrupted entries are treated as cache misses
+		except Exception:
+			return None
+
+		return header["taxa"], rows, header["attributes"]
+
+	def store (self, input_alignment, alignment_object):
+		""" Stores a parsed Alignment object in the cache. Alignments with sequences of unequal length are not stored """
+
+		attributes = {"input_format": alignment_object.input_format, "sequence_code": list(alignment_object.sequence_code), "model": alignment_object.model, "locus_length": alignment_object.locus_length}
+		taxa = list(alignment_object.alignment)
+
+		try:
+			Binary.write_binary(self._entry(input_alignment), taxa, alignment_object._sequence_bytes, alignment_object.locus_length, attributes)
+		except SequenceLengthError:
+			pass
+		except OSError:
+			print ("\nWARNING: The alignment %s could not be stored in the cache directory %s" % (input_alignment, self.cache_directory))
+
+	def evict (self):
+		""" Removes the least recently used entries until the size of the cache is below max_size """
+
+		entries = []
+		for entry in os.scandir(self.cache_directory):
+			if entry.name.endswith(".elc"):
+				entry_status = entry.stat()
+				entries.append((entry_status.st_mtime_ns, entry_status.st_size, entry.path))
+
+		cache_size = sum(size for mtime, size, path in entries)
+
+		for mtime, size, path in sorted(entries):
+			if cache_size <= self.max_size:
+				break
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+			cache_size -= size
@@ -73,6 +73,11 @@ class Partitions ():
 			
 		return partition_storage
 
+	def loci_ranges (self):
+		""" Returns the partitions as a list of (name, range) tuples, in the format of the loci_ranges attribute of the Alignment class """
+
+		return [(partition_name.strip(), "-".join([position.strip() for position in partition_range])) for model, partition_name, partition_range in self.partitions]
+
 	def write_to_file (self, output_format, output_file, model="LG"):
 		""" Writes the Partitions object into an output file according to the output_format. The supported output formats are RAxML and Nexus. The model option is for the RAxML format """
 
@@ -31,4 +31,10 @@ class OutputFormatError(Exception):
 	def __init__ (self, value):
 		self.value = value
 	def __str__ (self):
-		return repr(self.value)
\ No newline at end of file
+		return repr(self.value)
+
+class SequenceLengthError(Exception):
+	def __init__ (self, value):
+		self.value = value
+	def __str__ (self):
+		return repr(self.value)
@@ -19,4 +19,264 @@
 #  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 #  MA 02110-1301, USA.
 #  
-#  
\ No newline at end of file
+#  
+# Statistics engine of alignments. The metrics of each locus are computed in blocks of columns: the characters of a block are translated into state codes and counted for all rows and columns at once, and the counts of each taxon are accumulated over all loci
+
+from wingman.Base import Progression
+from wingman.Alignment import Alignment
+from collections import OrderedDict
+from multiprocessing import Pool
+
+# numpy is optional. When available, the characters of each block are counted with arrays
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+# Character states used to count variable and parsimony informative sites. Other residues, such as ambiguity codes, are not counted as states
+dna_states = b"acgt"
+protein_states = b"acdefghiklmnpqrstvwy"
+
+# Maximum number of columns processed at once, which limits the size of the arrays of very long alignments
+block_size = 65536
+
+def code_table (sequence_code):
+	""" Returns the translation table from characters to codes for the sequence_code of an alignment, and the number of states. Each state is translated into its position in the states alphabet (regardless of its case), gaps into the number of states, missing data into the number of states plus 1 and any other character into the number of states plus 2 """
+
+	states = dna_states if sequence_code[0] == "DNA" else protein_states
+	states_number = len(states)
+
+	table = bytearray([states_number + 2] * 256)
+
+	for position, state in enumerate(states):
+		table[state] = table[ord(chr(state).upper())] = position
+
+	table[ord("-")] = states_number
+
+	for symbol in [sequence_code[1], "?"]:
+		table[ord(symbol.lower())] = table[ord(symbol.upper())] = states_number + 1
+
+	return bytes(table), states_number
+
+def block_counts (rows, table, states_number):
+	""" Counts the characters of a block of columns, provided as a list of bytes objects of the same length. Returns a list with the (gaps, missing, states, gc) counts of each row, where states is the number of characters that are states and gc the number of 'c' and 'g' characters (only meaningful for DNA), and the numbers of variable and parsimony informative columns of the block """
+
+	if np is not None:
+		codes = np.frombuffer(b"".join(rows).translate(table), dtype=np.uint8).reshape(len(rows), -1)
+
+		gaps = (codes == states_number).sum(axis=1)
+		missing = (codes == states_number + 1).sum(axis=1)
+		states = (codes < states_number).sum(axis=1)
+		gc = ((codes == 1) | (codes == 2)).sum(axis=1)
+
+		# Number of occurrences of each state in each column
+		state_counts = np.stack([(codes == state).sum(axis=0) for state in range(states_number)])
+
+		variable = int(((state_counts > 0).sum(axis=0) > 1).sum())
+		informative = int(((state_counts > 1).sum(axis=0) > 1).sum())
+
+		return list(zip(gaps.tolist(), missing.tolist(), states.tolist(), gc.tolist())), variable, informative
+
+	# Without numpy, each row is counted with the count method of bytes objects, and the columns are generated by transposing the rows with zip
+	coded_rows = [row.translate(table) for row in rows]
+
+	row_counts = []
+	for row in coded_rows:
+		gaps, missing, others = row.count(states_number), row.count(states_number + 1), row.count(states_number + 2)
+		row_counts.append((gaps, missing, len(row) - gaps - missing - others, row.count(1) + row.count(2)))
+
+	variable, informative = 0, 0
+	for column in zip(*coded_rows):
+		state_counts = [column.count(state) for state in set(column) if state < states_number]
+		if len(state_counts) > 1:
+			variable += 1
+			if len([count for count in state_counts if count > 1]) > 1:
+				informative += 1
+
+	return row_counts, variable, informative
+
+def locus_metrics (alignment_object, start=0, end=None):
+	""" Returns the metrics of the sites between start and end of an Alignment object, which are read in blocks of at most block_size columns. Returns an OrderedDict with the metrics of the locus and an OrderedDict with the (sites, gaps, missing, states, gc) counts of each taxon with data in the locus. Taxa with only missing data are not included in the locus """
+
+	end = alignment_object.locus_length if end is None else end
+
+	table, states_number = code_table(alignment_object.sequence_code)
+	missing_symbol = alignment_object.sequence_code[1].encode("ascii")
+
+	taxa = list(alignment_object.alignment)
+	taxa_counts = [[0, 0, 0, 0] for taxon in taxa]
+	variable, informative = 0, 0
+
+	for block_start in range(start, end, block_size):
+
+		block_end = min(block_start + block_size, end)
+		rows = [alignment_object._sequence_slice(taxon, block_start, block_end).encode("ascii") for taxon in taxa]
+
+		# Sequences of unequal length are padded with missing data
+		rows = [row if len(row) == block_end - block_start else row.ljust(block_end - block_start, missing_symbol) for row in rows]
+
+		row_counts, block_variable, block_informative = block_counts(rows, table, states_number)
+
+		for counts, block_row in zip(taxa_counts, row_counts):
+			for position, count in enumerate(block_row):
+				counts[position] += count
+
+		variable += block_variable
+		informative += block_informative
+
+	sites = end - start
+	taxa_counts = OrderedDict((taxon, (sites,) + tuple(counts)) for taxon, counts in zip(taxa, taxa_counts) if counts[1] != sites)
+
+	gaps = sum(counts[1] for counts in taxa_counts.values())
+	missing = sum(counts[2] for counts in taxa_counts.values())
+	states = sum(counts[3] for counts in taxa_counts.values())
+	gc = sum(counts[4] for counts in taxa_counts.values())
+	cells = float(len(taxa_counts) * sites) or 1.0
+
+	# The length of each sequence is its number of sites without gaps or missing data
+	lengths = sorted(sites - counts[1] - counts[2] for counts in taxa_counts.values()) or [0]
+
+	metrics = OrderedDict()
+	metrics["taxa"] = len(taxa_counts)
+	metrics["sites"] = sites
+	metrics["missing_proportion"] = missing / cells
+	metrics["gap_proportion"] = gaps / cells
+	metrics["variable_sites"] = variable
+	metrics["informative_sites"] = informative
+	metrics["gc_content"] = gc / float(states) if alignment_object.sequence_code[0] == "DNA" and states else None
+	metrics["min_length"] = lengths[0]
+	metrics["mean_length"] = sum(lengths) / float(len(lengths))
+	metrics["median_length"] = (lengths[(len(lengths) - 1) // 2] + lengths[len(lengths) // 2]) / 2.0
+	metrics["max_length"] = lengths[-1]
+
+	return metrics, taxa_counts
+
+def alignment_metrics (alignment_object):
+	""" Returns a list with the name, the locus metrics and the taxa counts (see locus_metrics) of each locus of an Alignment object. The loci of concatenated alignments are defined by the loci_ranges attribute, and any other alignment is a single locus """
+
+	if getattr(alignment_object, "loci_ranges", None):
+		loci = []
+		for name, locus_range in alignment_object.loci_ranges:
+			# Loci ranges are 1-based and inclusive
+			start, end = [int(position) for position in locus_range.split("-")]
+			loci.append((name,) + locus_metrics(alignment_object, start - 1, end))
+		return loci
+
+	return [(alignment_object.input_alignment,) + locus_metrics(alignment_object)]
+
+def _file_metrics (arguments):
+	""" Parses a single alignment file and computes its metrics in a worker process of the AlignmentMetrics class. Only the metrics are returned, so that the alignment is released as soon as its metrics are computed. As in the Alignment module, errors that terminate with SystemExit are returned to be raised in the main process """
+
+	alignment_file, storage, cache, verbose, input_format = arguments
+
+	try:
+		return alignment_metrics(Alignment(alignment_file, input_format=input_format, storage=storage, cache=cache, verbose=verbose))
+	except SystemExit as error:
+		return error
+
+class AlignmentMetrics ():
+	""" Computes and stores the per-locus and per-taxon metrics of alignments: the proportions of missing data and gaps, the numbers of variable and parsimony informative sites, the GC content (for DNA) and the distribution of sequence lengths, which are the numbers of sites without gaps or missing data. Loci are added with the add_alignment, add_alignment_list and add_files methods, and the metrics are written into two TSV files with the write_to_file method """
+
+	def __init__ (self):
+
+		self.loci = []
+
+		# The counts of each taxon are accumulated over all loci: number of loci, sites, gaps, missing data, nucleotides (of DNA loci) and GC
+		self.taxa = OrderedDict()
+		self.total_sites = 0
+
+		self.log_progression = Progression()
+
+	def _add_loci (self, loci):
+		""" Adds the loci returned by the alignment_metrics function """
+
+		for name, metrics, taxa_counts in loci:
+
+			self.loci.append((name, metrics))
+			self.total_sites += metrics["sites"]
+
+			for taxon, (sites, gaps, missing, states, gc) in taxa_counts.items():
+				taxon_counts = self.taxa.setdefault(taxon, [0, 0, 0, 0, 0, 0])
+				taxon_counts[0] += 1
+				taxon_counts[1] += sites
+				taxon_counts[2] += gaps
+				taxon_counts[3] += missing
+				if metrics["gc_content"] is not None:
+					taxon_counts[4] += states
+					taxon_counts[5] += gc
+
+	def add_alignment (self, alignment_object):
+		""" Adds the loci of an Alignment object. A concatenated alignment with the loci_ranges attribute is added as its individual loci """
+
+		self._add_loci(alignment_metrics(alignment_object))
+
+	def add_alignment_list (self, alignment_list_object):
+		""" Adds the alignments of an AlignmentList object, which are not parsed again """
+
+		for alignment_object in alignment_list_object.alignment_object_list:
+			self.add_alignment(alignment_object)
+
+	def add_files (self, alignment_list, storage=None, threads=1, verbose=True, cache=None, input_format=None):
+		""" Parses a list of alignment files and adds their loci. With threads > 1, the files are parsed and measured by a pool of worker processes, and only the metrics are sent back to the main process. The loci are always added in the order of alignment_list """
+
+		self.log_progression.record("Measuring file", len(alignment_list))
+
+		tasks = ((alignment_file, storage, cache, verbose, input_format) for alignment_file in alignment_list)
+
+		if threads > 1:
+			pool = Pool(threads)
+			chunksize = max(1, min(64, len(alignment_list) // (threads * 4)))
+			results = pool.imap(_file_metrics, tasks, chunksize)
+		else:
+			results = map(_file_metrics, tasks)
+
+		for position, result in enumerate(results):
+
+			if verbose == True:
+				self.log_progression.progress_bar(position+1)
+
+			if type(result) is SystemExit:
+				if threads > 1:
+					pool.terminate()
+				raise result
+
+			self._add_loci(result)
+
+		if threads > 1:
+			pool.close()
+			pool.join()
+
+	def _format (self, value):
+		""" Formats a metric for the TSV files. Proportions are written with four decimal places and missing values as 'NA' """
+
+		if value is None:
+			return "NA"
+		elif type(value) is float:
+			return "%.4f" % (value)
+
+		return str(value)
+
+	def write_to_file (self, output_file):
+		""" Writes the metrics of each locus into output_file + '_loci.tsv' and the metrics of each taxon into output_file + '_taxa.tsv'. The proportions of missing data and gaps of each taxon are relative to the total number of sites of all loci, and the loci in which a taxon is absent count as missing data """
+
+		out_file = open(output_file + "_loci.tsv", "w")
+
+		if self.loci != []:
+			out_file.write("\t".join(["locus"] + list(self.loci[0][1])) + "\n")
+
+		for name, metrics in self.loci:
+			out_file.write("\t".join([name] + [self._format(value) for value in metrics.values()]) + "\n")
+
+		out_file.close()
+
+		out_file = open(output_file + "_taxa.tsv", "w")
+		out_file.write("taxon\tloci\tsites\tmissing_proportion\tgap_proportion\tgc_content\tsequence_length\n")
+
+		total_sites = float(self.total_sites) or 1.0
+
+		for taxon, (loci, sites, gaps, missing, states, gc) in self.taxa.items():
+			missing_proportion = (self.total_sites - sites + missing) / total_sites
+			gc_content = gc / float(states) if states else None
+			out_file.write("\t".join([taxon] + [self._format(value) for value in [loci, sites, missing_proportion, gaps / total_sites, gc_content, sites - gaps - missing]]) + "\n")
+
+		out_file.close()
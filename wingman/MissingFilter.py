@@ -21,6 +21,15 @@
 #  
 #  
 
+from wingman.Storage import CharacterMatrix
+from collections import OrderedDict
+
+# numpy is optional. When available, the column metrics of dictionary alignments are computed with arrays
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
 class MissingFilter ():
 	""" Contains several methods used to trim and filter missing data from alignments. It's mainly used for inheritance """
 
@@ -42,52 +51,104 @@ class MissingFilter ():
 	def filter_terminals (self):
 		""" Given an alignment, this will replace the gaps in the extremities of the alignment with missing data """
 
-		for taxa,seq in self.alignment.items():
-
-			trim_seq = list(seq)
-			counter, reverse_counter = 0, -1
-
-			while trim_seq[counter] == self.gap:
-				trim_seq[counter] = self.missing
-				counter += 1
-
-			while trim_seq[reverse_counter] == self.gap:
-				trim_seq[reverse_counter] = self.missing
-				reverse_counter -= 1
+		# In a matrix, the terminal gaps of all sequences are found at once with a cumulative test along the rows
+		if type(self.alignment) is CharacterMatrix:
+			self.alignment.compact()
+			matrix = self.alignment.matrix
+			gaps = matrix == ord(self.gap)
+			terminal_gaps = np.logical_and.accumulate(gaps, axis=1) | np.logical_and.accumulate(gaps[:, ::-1], axis=1)[:, ::-1]
+			matrix[terminal_gaps] = ord(self.missing)
+			return
 
-			seq = "".join(trim_seq)
+		for taxa,seq in self.alignment.items():
 
-			self.alignment[taxa] = seq
+			# The size of the terminal gaps is given by the length of the stripped sequence
+			leading = len(seq) - len(seq.lstrip(self.gap))
+			trailing = len(seq) - len(seq.rstrip(self.gap))
 
-	def filter_columns (self,verbose=False):
-		""" Here several missing data metrics are calculated, and based on some user defined thresholds, columns with inappropriate missing data are removed """
+			if leading == len(seq):
+				self.alignment[taxa] = self.missing * len(seq)
+			elif leading or trailing:
+				self.alignment[taxa] = self.missing * leading + seq[leading:len(seq)-trailing] + self.missing * trailing
 
-		taxa_number = len(self.alignment)
-		self.old_locus_length = len(list(self.alignment.values())[0])
+	def _column_counts (self):
+		""" Returns the number of gap and missing characters in each column of the alignment. The counts of all columns are obtained in a single pass over the sequences """
 
-		filtered_alignment = dict((taxa, list(seq)) for taxa, seq in self.alignment.items())
+		# The matrix and packed storages count the characters of all columns themselves
+		if np is not None and hasattr(self.alignment, "column_counts"):
+			return self.alignment.column_counts(self.gap), self.alignment.column_counts(self.missing)
 
-		# Creating the column list variable
-		for column_position in range(self.old_locus_length-1, -1, -1): # The reverse iteration over the sequences is necessary to maintain the column numbers when removing them
+		if np is not None:
+			gap_counts = np.zeros(self.old_locus_length, dtype=np.int64)
+			missing_counts = np.zeros(self.old_locus_length, dtype=np.int64)
+			for seq in self.alignment.values():
+				row = np.frombuffer(seq.encode("ascii"), dtype=np.uint8)
+				gap_counts += row == ord(self.gap)
+				missing_counts += row == ord(self.missing)
+			return gap_counts, missing_counts
 
-			if verbose == True:
-				print ("\rFiltering alignment column %s out of %s" % (column_position+1, self.old_locus_length+1), end="")
+		# Without numpy, the columns are generated one at a time by transposing the sequences with zip
+		gap_counts, missing_counts = [], []
+		for column in zip(*self.alignment.values()):
+			gap_counts.append(column.count(self.gap))
+			missing_counts.append(column.count(self.missing))
 
-			column = [char[column_position] for char in filtered_alignment.values()]
+		return gap_counts, missing_counts
 
-			# Calculating metrics
-			gap_proportion = (float(column.count(self.gap))/float(taxa_number))*float(100)
-			missing_proportion = (float(column.count(self.missing))/float(taxa_number))*float(100)
-			total_missing_proportion = gap_proportion+missing_proportion
+	def _keep_ranges (self, keep):
+		""" Converts a list of booleans with the columns to keep into a list of (start, end) tuples with the ranges of consecutive columns to keep """
 
-			if total_missing_proportion > float(self.gap_threshold):
+		ranges, start = [], None
 
-				list(map ((lambda seq: seq.pop(column_position)), filtered_alignment.values()))
+		for position, kept in enumerate(keep):
+			if kept and start is None:
+				start = position
+			elif not kept and start is not None:
+				ranges.append((start, position))
+				start = None
 
-			elif missing_proportion > float(self.missing_threshold):
+		if start is not None:
+			ranges.append((start, len(keep)))
 
-				list(map ((lambda seq: seq.pop(column_position)), filtered_alignment.values()))
+		return ranges
 
-		self.alignment = dict((taxa, "".join(seq)) for taxa,seq in filtered_alignment.items())
-		self.locus_length = len(list(self.alignment.values())[0])
+	def filter_columns (self,verbose=False):
+		""" Here several missing data metrics are calculated, and based on some user defined thresholds, columns with inappropriate missing data are removed. The metrics of all columns are calculated at once, and each sequence is sliced only once according to the columns that are kept """
 
+		taxa_number = len(self.alignment)
+		self.old_locus_length = len(next(iter(self.alignment.values())))
+
+		if verbose == True:
+			print ("\rFiltering %s alignment columns" % (self.old_locus_length), end="")
+
+		gap_counts, missing_counts = self._column_counts()
+
+		# Calculating metrics
+		if np is not None:
+			gap_proportion = gap_counts / float(taxa_number) * float(100)
+			missing_proportion = missing_counts / float(taxa_number) * float(100)
+			total_missing_proportion = gap_proportion + missing_proportion
+			keep = (total_missing_proportion <= float(self.gap_threshold)) & (missing_proportion <= float(self.missing_threshold))
+		else:
+			keep = []
+			for gap_count, missing_count in zip(gap_counts, missing_counts):
+				gap_proportion = (float(gap_count)/float(taxa_number))*float(100)
+				missing_proportion = (float(missing_count)/float(taxa_number))*float(100)
+				total_missing_proportion = gap_proportion+missing_proportion
+				keep.append(total_missing_proportion <= float(self.gap_threshold) and missing_proportion <= float(self.missing_threshold))
+
+		if type(self.alignment) is CharacterMatrix:
+			self.alignment = self.alignment.take_columns(keep)
+			self.locus_length = self.alignment.locus_length
+			return
+
+		if np is not None:
+			keep = keep.tolist()
+
+		ranges = self._keep_ranges(keep)
+
+		# If all columns are kept, the sequences are not copied
+		if ranges != [(0, self.old_locus_length)]:
+			self.alignment = OrderedDict((taxa, "".join([seq[start:end] for start, end in ranges])) for taxa, seq in self.alignment.items())
+
+		self.locus_length = sum(end - start for start, end in ranges)
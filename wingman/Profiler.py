@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#
+#  Copyright 2012 Unknown <diogo@arch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+from collections import OrderedDict
+import json
+import os
+import sys
+import time
+
+# The resource module is not available in all platforms. Without it, the peak memory is only read from /proc
+try:
+	import resource
+except ImportError:
+	resource = None
+
+class StageProfiler ():
+	""" Records the resources used by each stage of a run: the wall time, the CPU time (including the CPU time of finished worker processes), the bytes read and written by the main process and its peak resident memory (RSS). The stages are sequential: each call to the stage method ends the current stage and starts a new one. The bytes read and written are taken from /proc/self/io and, on Linux, the peak RSS is reset at the start of each stage, so that it is the peak of the stage itself. Elsewhere, the peak RSS is the peak of the process up to the end of the stage, and the bytes are not available. When the profiler is not enabled, its methods do nothing """
+
+	def __init__ (self, enabled=True):
+
+		self.enabled = enabled
+		self.stages = []
+		self.current = None
+
+	def _io_counters (self):
+		""" Returns the numbers of bytes read and written by the process, or (None, None) if they are not available """
+
+		try:
+			file_handle = open("/proc/self/io")
+			counters = dict(line.split(":") for line in file_handle)
+			file_handle.close()
+		except (OSError, ValueError):
+			return None, None
+
+		return int(counters["rchar"]), int(counters["wchar"])
+
+	def _reset_peak_rss (self):
+		""" Resets the peak RSS of the process, which is only supported by Linux """
+
+		try:
+			file_handle = open("/proc/self/clear_refs", "w")
+			file_handle.write("5")
+			file_handle.close()
+		except OSError:
+			pass
+
+	def _peak_rss (self):
+		""" Returns the peak RSS of the process, in bytes, or None if it is not available """
+
+		try:
+			file_handle = open("/proc/self/status")
+			for line in file_handle:
+				if line.startswith("VmHWM:"):
+					file_handle.close()
+					return int(line.split()[1]) * 1024
+			file_handle.close()
+		except OSError:
+			pass
+
+		if resource is None:
+			return None
+
+		# The maximum RSS is reported in kilobytes, except in macOS, where it is reported in bytes
+		peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+		return peak if sys.platform == "darwin" else peak * 1024
+
+	def _snapshot (self):
+		""" Returns the current wall time, CPU time and bytes read and written """
+
+		times = os.times()
+		bytes_read, bytes_written = self._io_counters()
+
+		return {"wall": time.perf_counter(), "cpu": times.user + times.system + times.children_user + times.children_system, "read": bytes_read, "written": bytes_written}
+
+	def stage (self, name):
+		""" Ends the current stage, if any, and starts a new stage with the given name """
+
+		if self.enabled is False:
+			return
+
+		self.end()
+		self._reset_peak_rss()
+		self.current = (name, self._snapshot())
+
+	def end (self):
+		""" Ends the current stage and records its resources """
+
+		if self.current is None:
+			return
+
+		name, start = self.current
+		end = self._snapshot()
+
+		stage = OrderedDict()
+		stage["stage"] = name
+		stage["wall_time"] = end["wall"] - start["wall"]
+		stage["cpu_time"] = end["cpu"] - start["cpu"]
+		stage["bytes_read"] = end["read"] - start["read"] if start["read"] is not None else None
+		stage["bytes_written"] = end["written"] - start["written"] if start["written"] is not None else None
+		stage["peak_rss"] = self._peak_rss()
+
+		self.stages.append(stage)
+		self.current = None
+
+	def total (self):
+		""" Returns the sum of the times and bytes of all stages and the maximum of their peak RSS """
+
+		total = OrderedDict([("stage", "Total")])
+
+		for key in ["wall_time", "cpu_time", "bytes_read", "bytes_written"]:
+			values = [stage[key] for stage in self.stages if stage[key] is not None]
+			total[key] = sum(values) if values != [] else None
+
+		peaks = [stage["peak_rss"] for stage in self.stages if stage["peak_rss"] is not None]
+		total["peak_rss"] = max(peaks) if peaks != [] else None
+
+		return total
+
+	def report (self):
+		""" Prints a table with the resources of each stage """
+
+		def megabytes (value):
+			return "%.1f" % (value / 1048576.0) if value is not None else "NA"
+
+		print ("\n%-30s %10s %10s %12s %12s %14s" % ("Stage", "Wall (s)", "CPU (s)", "Read (MB)", "Written (MB)", "Peak RSS (MB)"))
+
+		for stage in self.stages + [self.total()]:
+			print ("%-30s %10.2f %10.2f %12s %12s %14s" % (stage["stage"], stage["wall_time"], stage["cpu_time"], megabytes(stage["bytes_read"]), megabytes(stage["bytes_written"]), megabytes(stage["peak_rss"])))
+
+	def write_to_file (self, output_file, command=None):
+		""" Writes the resources of each stage and their total into a JSON file. Optionally, the command line arguments of the run are included in the report """
+
+		report = OrderedDict([("command", command), ("stages", self.stages), ("total", self.total())])
+
+		out_file = open(output_file, "w")
+		json.dump(report, out_file, indent=1)
+		out_file.close()
@@ -0,0 +1,672 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#
+#  Copyright 2012 Unknown <diogo@arch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+from wingman.ErrorHandling import *
+from wingman import Binary
+from collections import OrderedDict
+from collections.abc import MutableMapping
+import mmap
+import os
+import re
+
+# numpy is only required for the matrix storage. The default dictionary storage of the Alignment class works without it
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+# Memory maps of the MappedPhylip and MappedBinary objects, by file. Each map holds a file descriptor, so only the most recently used maps are kept open, and the others are opened again when they are accessed
+open_maps = OrderedDict()
+max_open_maps = 64
+
+def _map_key (input_file):
+	""" Returns the key of a file in open_maps, with its name, size and modification time, so that a file that is replaced is mapped again """
+
+	file_stat = os.stat(input_file)
+
+	return (input_file, file_stat.st_size, file_stat.st_mtime_ns)
+
+def _open_map (map_key):
+	""" Returns a read-only memory map of the file of map_key (see _map_key), which is shared by all objects of the same file. The file itself is closed as soon as it is mapped """
+
+	if map_key in open_maps:
+		open_maps.move_to_end(map_key)
+		return open_maps[map_key]
+
+	file_handle = open(map_key[0], "rb")
+	try:
+		file_map = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+	finally:
+		file_handle.close()
+
+	while len(open_maps) >= max_open_maps:
+		open_maps.popitem(last=False)[1].close()
+
+	open_maps[map_key] = file_map
+
+	return file_map
+
+class CharacterMatrix (MutableMapping):
+	""" Storage engine for alignments that keeps all sequences in a single 2-D uint8 array of shape (taxa x sites) plus a taxon index. It behaves like the ordered dictionary used by the Alignment class (taxa names as keys and sequence strings as values), so that existing code keeps working on top of it, while column operations can be applied to the whole matrix at once """
+
+	def __init__ (self, alignment_dict=None, matrix=None, taxa=None):
+		""" The matrix can be built from a dictionary-like object with taxa names as keys and sequences as values, or directly from an existing 2-D array and the corresponding list of taxa names """
+
+		if np is None:
+			print ("\nThe matrix storage requires the numpy module, which could not be found. Please install numpy or use the default storage. Exiting...")
+			raise SystemExit
+
+		if matrix is not None:
+			self.matrix = matrix
+			self.taxa_index = OrderedDict((taxon, row) for row, taxon in enumerate(taxa))
+
+		else:
+			rows = [seq.encode("ascii") for seq in alignment_dict.values()]
+			locus_length = len(rows[0]) if rows else 0
+
+			if any(len(row) != locus_length for row in rows):
+				raise SequenceLengthError("All sequences must have the same length to be stored in a character matrix")
+
+			# The bytearray makes the resulting array writable without an additional copy
+			self.matrix = np.frombuffer(bytearray(b"".join(rows)), dtype=np.uint8).reshape(len(rows), locus_length)
+			self.taxa_index = OrderedDict((taxon, row) for row, taxon in enumerate(alignment_dict))
+
+	def __getitem__ (self, taxon):
+
+		return self.matrix[self.taxa_index[taxon]].tobytes().decode("ascii")
+
+	def __setitem__ (self, taxon, sequence):
+
+		if len(sequence) != self.locus_length:
+			raise SequenceLengthError("Sequence of taxon %s has %s characters, but the matrix has %s sites" % (taxon, len(sequence), self.locus_length))
+
+		row = np.frombuffer(sequence.encode("ascii"), dtype=np.uint8)
+
+		if taxon in self.taxa_index:
+			self.matrix[self.taxa_index[taxon]] = row
+		else:
+			self.taxa_index[taxon] = self.matrix.shape[0]
+			self.matrix = np.vstack((self.matrix, row))
+
+	def __delitem__ (self, taxon):
+		""" Only the taxon index is updated. The row remains in the array until the matrix is compacted """
+
+		del self.taxa_index[taxon]
+
+	def __iter__ (self):
+
+		return iter(self.taxa_index)
+
+	def __len__ (self):
+
+		return len(self.taxa_index)
+
+	def __contains__ (self, taxon):
+
+		return taxon in self.taxa_index
+
+	@property
+	def locus_length (self):
+
+		return self.matrix.shape[1]
+
+	def active_matrix (self):
+		""" Returns the array with the rows of the indexed taxa, in the order of the index. When no rows have been removed or reordered, the array itself is returned and no copy is made """
+
+		rows = list(self.taxa_index.values())
+
+		if rows == list(range(self.matrix.shape[0])):
+			return self.matrix
+
+		return self.matrix[rows]
+
+	def compact (self):
+		""" Drops the rows that are no longer indexed from the array """
+
+		self.matrix = self.active_matrix()
+		self.taxa_index = OrderedDict((taxon, row) for row, taxon in enumerate(self.taxa_index))
+
+	def row_bytes (self, taxon):
+		""" Returns the sequence of a taxon as a bytes object, without decoding it """
+
+		return self.matrix[self.taxa_index[taxon]].tobytes()
+
+	def sequence_slice (self, taxon, start, end):
+		""" Returns a slice of the sequence of a taxon as a string, without decoding the whole row """
+
+		return self.matrix[self.taxa_index[taxon], start:end].tobytes().decode("ascii")
+
+	def column_counts (self, symbol):
+		""" Returns an array with the number of occurrences of symbol in each column of the alignment """
+
+		return (self.active_matrix() == ord(symbol)).sum(axis=0)
+
+	def take_columns (self, columns):
+		""" Returns a new CharacterMatrix with only the provided columns. The columns argument may be a boolean mask or an array of column positions """
+
+		return CharacterMatrix(matrix=self.active_matrix()[:, columns], taxa=list(self.taxa_index))
+
+	def slice_columns (self, start, end):
+		""" Returns a new CharacterMatrix with the columns between start and end. The new matrix is a view of the current one, so no sequence data is copied """
+
+		return CharacterMatrix(matrix=self.active_matrix()[:, start:end], taxa=list(self.taxa_index))
+
+	def take_rows (self, taxa, names=None):
+		""" Returns a new CharacterMatrix with the rows of the provided taxa. Optionally, the rows can be renamed with the names list """
+
+		rows = [self.taxa_index[taxon] for taxon in taxa]
+
+		return CharacterMatrix(matrix=self.matrix[rows], taxa=names if names is not None else list(taxa))
+
+	def to_dict (self):
+		""" Returns the alignment as an ordered dictionary of strings """
+
+		return OrderedDict((taxon, self[taxon]) for taxon in self.taxa_index)
+
+class PackedMatrix (MutableMapping):
+	""" Storage engine for nucleotide alignments that keeps each sequence packed with two characters per byte, using the '4bit' encoding of the Binary module, which preserves gaps, missing data and IUPAC ambiguity codes. This halves the memory used by the sequences. Alignments with other characters, such as proteins or coded gaps, are stored with one character per byte. It behaves like the ordered dictionary used by the Alignment class, and sequences are only decoded when they are accessed """
+
+	def __init__ (self, alignment_dict=None):
+		""" The matrix can be built from a dictionary-like object with taxa names as keys and sequences as values. A SequenceLengthError is raised if the sequences do not have the same length """
+
+		self.rows = OrderedDict() # Stores the packed sequence of each taxon
+		self.encoding = "4bit"
+		self.nchar = None
+
+		if alignment_dict is not None:
+			sequences = [(taxon, sequence.encode("ascii")) for taxon, sequence in alignment_dict.items()]
+
+			if any(not Binary.packable(sequence) for taxon, sequence in sequences):
+				self.encoding = "byte"
+
+			for taxon, sequence in sequences:
+				self._store(taxon, sequence)
+
+	def _store (self, taxon, sequence):
+		""" Packs and stores a sequence (bytes object). When a sequence cannot be packed with the '4bit' encoding, all sequences are converted to the 'byte' encoding """
+
+		if self.nchar is None:
+			self.nchar = len(sequence)
+		elif len(sequence) != self.nchar:
+			raise SequenceLengthError("Sequence of taxon %s has %s characters, but the matrix has %s sites" % (taxon, len(sequence), self.nchar))
+
+		if self.encoding == "4bit" and not Binary.packable(sequence):
+			self.rows = OrderedDict((name, self.row_bytes(name)) for name in self.rows)
+			self.encoding = "byte"
+
+		self.rows[taxon] = Binary.pack_row(sequence, self.encoding)
+
+	def __getitem__ (self, taxon):
+
+		return self.row_bytes(taxon).decode("ascii")
+
+	def __setitem__ (self, taxon, sequence):
+
+		self._store(taxon, sequence.encode("ascii"))
+
+	def __delitem__ (self, taxon):
+
+		del self.rows[taxon]
+
+	def __iter__ (self):
+
+		return iter(self.rows)
+
+	def __len__ (self):
+
+		return len(self.rows)
+
+	def __contains__ (self, taxon):
+
+		return taxon in self.rows
+
+	@property
+	def locus_length (self):
+
+		return self.nchar or 0
+
+	def row_bytes (self, taxon):
+		""" Returns the sequence of a taxon as a bytes object """
+
+		return Binary.unpack_row(self.rows[taxon], self.nchar, self.encoding)
+
+	def packed_row (self, taxon):
+		""" Returns the packed sequence of a taxon. Since the encoding is the same for all taxa, equal sequences have equal packed sequences, so they can be compared without being decoded """
+
+		return self.rows[taxon]
+
+	def sequence_slice (self, taxon, start, end):
+		""" Returns a slice of the sequence of a taxon as a string. Only the bytes that contain the slice are decoded """
+
+		return Binary.unpack_row(self.rows[taxon], self.nchar, self.encoding, start, end).decode("ascii")
+
+	def column_counts (self, symbol):
+		""" Returns an array with the number of occurrences of symbol in each column of the alignment. With the '4bit' encoding, the codes of the even and odd columns are compared directly on the packed sequences (requires numpy) """
+
+		if self.encoding == "byte" or Binary.code_table[ord(symbol)] == 255:
+			matrix = np.frombuffer(b"".join(self.row_bytes(taxon) for taxon in self.rows), dtype=np.uint8).reshape(len(self.rows), self.locus_length)
+			return (matrix == ord(symbol)).sum(axis=0)
+
+		code = Binary.code_table[ord(symbol)]
+		packed = np.frombuffer(b"".join(self.rows.values()), dtype=np.uint8).reshape(len(self.rows), Binary.row_size(self.locus_length, self.encoding))
+
+		counts = np.empty(packed.shape[1] * 2, dtype=np.int64)
+		counts[0::2] = ((packed >> 4) == code).sum(axis=0)
+		counts[1::2] = ((packed & 15) == code).sum(axis=0)
+
+		return counts[:self.locus_length]
+
+	def take_rows (self, taxa, names=None):
+		""" Returns a new PackedMatrix with the rows of the provided taxa, which are shared with the current matrix. Optionally, the rows can be renamed with the names list """
+
+		packed = PackedMatrix()
+		packed.encoding = self.encoding
+		packed.nchar = self.nchar
+		packed.rows = OrderedDict((name, self.rows[taxon]) for name, taxon in zip(names if names is not None else taxa, taxa))
+
+		return packed
+
+	def to_dict (self):
+		""" Returns the alignment as an ordered dictionary of strings """
+
+		return OrderedDict((taxon, self[taxon]) for taxon in self.rows)
+
+class MappedPhylip (MutableMapping):
+	""" Read-only storage engine for sequential phylip files. The file is memory-mapped and only an index with the start and end position of each taxon sequence is built, so the sequences are read from the file when they are accessed and slices of a sequence only read the corresponding byte range. It behaves like the ordered dictionary used by the Alignment class. Sequences that are modified are kept in memory, without changing the file. The memory map is not kept by the object, but opened with the _open_map function when a sequence is read, so that many mapped alignments do not hold one file descriptor each """
+
+	# Matches the taxon name of a row and the whitespace that separates it from the sequence
+	row_pattern = re.compile(rb"[ \t]*([^ \t\r\n]+)[ \t]+")
+
+	def __init__ (self, phylip_file, taxa_filter=None):
+		""" The taxa_filter argument is an optional function applied to the taxa names, such as the rm_illegal method of the Base class. A SequenceLengthError is raised if the file is not a sequential phylip file with one row per taxon """
+
+		self.input_file = phylip_file
+		self.taxa_filter = taxa_filter
+		self._map_file()
+
+	def _map_file (self):
+		""" Memory-maps the phylip file and builds the index of taxa sequences. The map is only kept in the map attribute while the index is built """
+
+		self.map_key = _map_key(self.input_file)
+		self.map = _open_map(self.map_key)
+		self.taxa_index = OrderedDict()
+		self.modified = {}
+
+		try:
+			self._index_rows()
+		finally:
+			del self.map
+
+	def _index_rows (self):
+		""" Supports the _map_file method by indexing the rows of the phylip file """
+
+		file_size = len(self.map)
+		position, header = 0, b""
+
+		# Skips first empty lines, if any, and gets the number of taxa and sequence length from the file header
+		while header.strip() == b"" and position < file_size:
+			line_end = self._line_end(position)
+			header = self.map[position:line_end]
+			position = line_end + 1
+
+		try:
+			taxa_number, self.nchar = [int(field) for field in header.split()]
+		except ValueError:
+			raise SequenceLengthError("File %s does not start with a phylip header" % (self.input_file))
+
+		while position < file_size:
+			line_end = self._line_end(position)
+			match = self.row_pattern.match(self.map, position, line_end)
+
+			if match is None:
+				if self.map[position:line_end].strip() != b"":
+					raise SequenceLengthError("Row without sequence in file %s" % (self.input_file))
+
+			else:
+				sequence_start, sequence_end = match.end(), line_end
+				while sequence_end > sequence_start and self.map[sequence_end-1] in b" \t\r":
+					sequence_end -= 1
+
+				if sequence_end - sequence_start != self.nchar:
+					raise SequenceLengthError("Rows of file %s do not contain complete sequences" % (self.input_file))
+
+				taxon = match.group(1).decode("utf-8")
+				if self.taxa_filter is not None:
+					taxon = self.taxa_filter(taxon)
+
+				self.taxa_index[taxon] = (sequence_start, sequence_end)
+
+			position = line_end + 1
+
+		if len(self.taxa_index) != taxa_number:
+			raise SequenceLengthError("The number of rows of file %s does not match its header" % (self.input_file))
+
+	def _line_end (self, position):
+		""" Returns the position of the end of the line that starts at position """
+
+		line_end = self.map.find(b"\n", position)
+
+		return line_end if line_end != -1 else len(self.map)
+
+	def __getstate__ (self):
+		""" The object holds no memory map or file, so the index, with the position and name of each row, is pickled as it is and the file is not indexed again when the object is unpickled """
+
+		return self.__dict__
+
+	def __setstate__ (self, state):
+
+		self.__dict__.update(state)
+
+	def __getitem__ (self, taxon):
+
+		if taxon in self.modified:
+			return self.modified[taxon]
+
+		return self._read(self.taxa_index[taxon]).decode("ascii")
+
+	def __setitem__ (self, taxon, sequence):
+
+		if taxon not in self.taxa_index:
+			self.taxa_index[taxon] = None
+
+		self.modified[taxon] = sequence
+
+	def __delitem__ (self, taxon):
+
+		del self.taxa_index[taxon]
+		self.modified.pop(taxon, None)
+
+	def __iter__ (self):
+
+		return iter(self.taxa_index)
+
+	def __len__ (self):
+
+		return len(self.taxa_index)
+
+	def __contains__ (self, taxon):
+
+		return taxon in self.taxa_index
+
+	@property
+	def locus_length (self):
+
+		return self.nchar
+
+	def row_bytes (self, taxon):
+		""" Returns the sequence of a taxon as a bytes object, without decoding it """
+
+		if taxon in self.modified:
+			return self.modified[taxon].encode("ascii")
+
+		return self._read(self.taxa_index[taxon])
+
+	def take_rows (self, taxa, names=None):
+		""" Returns a new object of the same class, reading the same file as the current one, with only the rows of the provided taxa. Optionally, the rows can be renamed with the names list. No sequence data is read """
+
+		names = names if names is not None else list(taxa)
+
+		mapped = self.__class__.__new__(self.__class__)
+		mapped.__dict__.update(self.__dict__)
+		mapped.taxa_index = OrderedDict((name, self.taxa_index[taxon]) for name, taxon in zip(names, taxa))
+		mapped.modified = dict((name, self.modified[taxon]) for name, taxon in zip(names, taxa) if taxon in self.modified)
+
+		return mapped
+
+	def sequence_slice (self, taxon, start, end):
+		""" Returns a slice of the sequence of a taxon as a string. Only the byte range of the slice is read from the file """
+
+		if taxon in self.modified:
+			return self.modified[taxon][start:end]
+
+		return self._read(self.taxa_index[taxon], start, end).decode("ascii")
+
+	def _read (self, location, start=0, end=None):
+		""" Reads the characters between start and end of the sequence at the provided location of the index, as a lowercase bytes object """
+
+		sequence_start, sequence_end = location
+		end = sequence_end if end is None else min(sequence_start+end, sequence_end)
+
+		return _open_map(self.map_key)[min(sequence_start+start, sequence_end):end].lower()
+
+class MappedBinary (MappedPhylip):
+	""" Read-only storage engine for binary alignment files (see the Binary module). The file is memory-mapped and the index only contains the position of each row, which is read from the header, so loading the alignment does not read any sequence data. Sequences stored with one byte per character are sliced directly from the memory map, and packed sequences are decoded on access. It behaves like the MappedPhylip class """
+
+	def __init__ (self, binary_file):
+
+		self.input_file = binary_file
+		self.taxa_filter = None
+		self._map_file()
+
+	def _map_file (self):
+		""" Memory-maps the binary file and builds the index of taxa sequences from its header. A SequenceLengthError is raised if the file is not a binary alignment """
+
+		self.modified = {}
+
+		self.map_key = _map_key(self.input_file)
+		self.header, data_start = Binary.read_header(_open_map(self.map_key), self.input_file)
+		self.nchar = self.header["locus_length"]
+		self.encoding = self.header["encoding"]
+		size = Binary.row_size(self.nchar, self.encoding)
+
+		self.taxa_index = OrderedDict((taxon, data_start + row * size) for row, taxon in enumerate(self.header["taxa"]))
+
+	def _read (self, location, start=0, end=None):
+
+		# The memoryview avoids copying the packed bytes before they are decoded
+		return Binary.unpack_row(memoryview(_open_map(self.map_key))[location:location + Binary.row_size(self.nchar, self.encoding)], self.nchar, self.encoding, start, end)
+
+class IndexedAlignment (MappedPhylip):
+	""" Read-only storage engine for fasta, sequential phylip and sequential nexus files that only indexes the taxa and the byte range of each sequence, which may span several lines. The file is memory-mapped while the index is built and then closed, and the sequences are read from the file when they are accessed, so that many indexed alignments can be kept at once without holding their sequences or file descriptors. The to_dict method reads the sequences of all taxa at once, with a single open file. It behaves like the MappedPhylip class, and a SequenceLengthError is raised if the file cannot be indexed, such as an interleaved file """
+
+	# Whitespace removed from sequences that span several lines or are split in blocks
+	whitespace = b" \t\r\n"
+	whitespace_pattern = re.compile(rb"[ \t\r\n]")
+
+	def __init__ (self, input_file, input_format, taxa_filter=None, validator=None):
+		""" The validator argument is an optional AlignmentValidator object, in which the length of each sequence and the duplicated taxa are recorded while the file is indexed. It is not kept after indexing """
+
+		self.input_file = input_file
+		self.input_format = input_format
+		self.taxa_filter = taxa_filter
+		self.validator = validator
+		self._map_file()
+
+	def _map_file (self):
+		""" Builds the index of taxa sequences. Each entry contains the start and end positions of the sequence and whether the sequence is contiguous, without any whitespace, in which case slices are read directly from the file """
+
+		self.taxa_index = OrderedDict()
+		self.modified = {}
+		self.model = []
+
+		file_handle = open(self.input_file, "rb")
+
+		try:
+			self.map = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+		# Empty files cannot be memory-mapped
+		except ValueError:
+			file_handle.close()
+			raise SequenceLengthError("File %s is empty" % (self.input_file))
+
+		try:
+			if self.input_format == "fasta":
+				self._index_fasta()
+			elif self.input_format == "phylip":
+				self._index_phylip()
+			elif self.input_format == "nexus":
+				self._index_nexus()
+			else:
+				raise SequenceLengthError("File %s cannot be indexed" % (self.input_file))
+
+			if not self.taxa_index:
+				raise SequenceLengthError("File %s has no sequences" % (self.input_file))
+
+			# The length of fasta and nexus sequences is given by the first sequence, as in the parser of the Alignment class
+			if self.input_format != "phylip":
+				self.nchar = len(self._read(next(iter(self.taxa_index.values()))))
+
+		finally:
+			self.map.close()
+			del self.map
+			del self.validator
+			file_handle.close()
+
+	def _add_taxon (self, taxon, sequence_start, sequence_end):
+		""" Adds a sequence to the index, after removing the whitespace at its end """
+
+		while sequence_end > sequence_start and self.map[sequence_end-1] in self.whitespace:
+			sequence_end -= 1
+
+		if self.taxa_filter is not None:
+			taxon = self.taxa_filter(taxon)
+
+		contiguous = self.whitespace_pattern.search(self.map, sequence_start, sequence_end) is None
+
+		if self.validator is not None:
+			sequence_length = sequence_end - sequence_start if contiguous else len(self.map[sequence_start:sequence_end].translate(None, self.whitespace))
+			self.validator.add_sequence(taxon, sequence_length)
+
+		self.taxa_index[taxon] = (sequence_start, sequence_end, contiguous)
+
+	def _index_fasta (self):
+
+		position = self.map.find(b">")
+
+		while position != -1:
+			line_end = self._line_end(position)
+			next_header = self.map.find(b"\n>", line_end)
+			sequence_end = next_header if next_header != -1 else len(self.map)
+
+			taxon = self.map[position+1:line_end].strip().decode("utf-8").replace(" ","_")
+			self._add_taxon(taxon, min(line_end+1, sequence_end), sequence_end)
+
+			position = next_header + 1 if next_header != -1 else -1
+
+	def _index_phylip (self):
+		""" Indexes a sequential phylip file, in which the sequence of each taxon starts in the row of its name and may continue in the following lines until it has the number of sites of the header """
+
+		file_size = len(self.map)
+		position, header = 0, b""
+
+		while header.strip() == b"" and position < file_size:
+			line_end = self._line_end(position)
+			header = self.map[position:line_end]
+			position = line_end + 1
+
+		try:
+			taxa_number, self.nchar = [int(field) for field in header.split()[:2]]
+		except ValueError:
+			raise SequenceLengthError("File %s does not start with a phylip header" % (self.input_file))
+
+		while position < file_size:
+			line_end = self._line_end(position)
+
+			if self.map[position:line_end].strip() == b"":
+				position = line_end + 1
+				continue
+
+			match = self.row_pattern.match(self.map, position, line_end)
+			if match is None or len(self.taxa_index) == taxa_number:
+				raise SequenceLengthError("File %s is not a sequential phylip file" % (self.input_file))
+
+			sequence_start = match.end()
+			filled = len(self.map[sequence_start:line_end].translate(None, self.whitespace))
+
+			while filled < self.nchar and line_end < file_size:
+				continuation_end = self._line_end(line_end + 1)
+				filled += len(self.map[line_end+1:continuation_end].translate(None, self.whitespace))
+				line_end = continuation_end
+
+			if filled != self.nchar:
+				raise SequenceLengthError("File %s is not a sequential phylip file with sequences of %s sites" % (self.input_file, self.nchar))
+
+			self._add_taxon(match.group(1).decode("utf-8"), sequence_start, line_end)
+			position = line_end + 1
+
+		if len(self.taxa_index) != taxa_number:
+			raise SequenceLengthError("The number of rows of file %s does not match its header" % (self.input_file))
+
+	def _index_nexus (self):
+		""" Indexes a sequential nexus file, with one row per taxon in its matrix. The substitution models of the file are kept in the model attribute """
+
+		file_size = len(self.map)
+		position, counter = 0, 0
+
+		while position < file_size:
+			line_end = self._line_end(position)
+			line = self.map[position:line_end].strip()
+
+			if line.lower() == b"matrix" and counter == 0:
+				counter = 1
+			elif line == b";" and counter == 1:
+				counter = 2
+			elif line != b"" and counter == 1:
+				match = self.row_pattern.match(self.map, position, line_end)
+				if match is None:
+					raise SequenceLengthError("Row without sequence in file %s" % (self.input_file))
+				taxon = match.group(1).decode("utf-8")
+				# A repeated taxon means that the file is interleaved
+				if (self.taxa_filter(taxon) if self.taxa_filter is not None else taxon) in self.taxa_index:
+					raise SequenceLengthError("File %s is not a sequential nexus file" % (self.input_file))
+				self._add_taxon(taxon, match.end(), line_end)
+			elif counter == 2 and (line.lower().startswith(b"lset") or line.lower().startswith(b"prset")):
+				self.model.append(line.decode("utf-8"))
+
+			position = line_end + 1
+
+	def _read (self, location, start=0, end=None, file_handle=None):
+		""" Reads the characters between start and end of the sequence at the provided location of the index, as a lowercase bytes object. The sequence is read from the memory map while the file is indexed, and otherwise from the file, which is opened unless an open file_handle is provided """
+
+		sequence_start, sequence_end, contiguous = location
+
+		if getattr(self, "map", None) is not None:
+			sequence = self.map[sequence_start:sequence_end]
+			return sequence.translate(None, self.whitespace)[start:end].lower()
+
+		close_file = file_handle is None
+		if close_file:
+			file_handle = open(self.input_file, "rb")
+
+		# Slices of contiguous sequences are read directly from the file
+		if contiguous:
+			end = sequence_end - sequence_start if end is None else min(end, sequence_end - sequence_start)
+			start = min(start, end)
+			file_handle.seek(sequence_start + start)
+			sequence = file_handle.read(end - start)
+		else:
+			file_handle.seek(sequence_start)
+			sequence = file_handle.read(sequence_end - sequence_start).translate(None, self.whitespace)[start:end]
+
+		if close_file:
+			file_handle.close()
+
+		return sequence.lower()
+
+	def to_dict (self):
+		""" Returns the alignment as an ordered dictionary of strings, opening the file only once """
+
+		file_handle = open(self.input_file, "rb")
+		alignment_dict = OrderedDict((taxon, self.modified[taxon] if taxon in self.modified else self._read(location, file_handle=file_handle).decode("ascii")) for taxon, location in self.taxa_index.items())
+		file_handle.close()
+
+		return alignment_dict